@@ -0,0 +1,171 @@
+"""End-to-end benchmark on synthetic Titanic-shaped data.
+
+Generates passenger tables with the schema of data/train.csv and data/test.csv
+at several multiples of their size, runs every pipeline stage on them, and
+records wall time and resident memory (with worker processes) per stage:
+
+    python benchmark.py --scales 1 10 --baseline temp/benchmark/baseline.json
+
+Scales run with sparse encoding by default. --dense encodes every feature as
+dense dummy columns instead, which is only run up to MAX_DENSE_SCALE: the
+dummy matrix grows quadratically with the number of passengers, and 100x
+already needs around 100 GB.
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import main
+from titanic_classifier import SurvivalClassifier
+from instrumentation import Tracer
+
+TRAIN_ROWS = 891
+TEST_ROWS = 418
+MAX_DENSE_SCALE = 10
+
+
+def synthetic_passengers(template, n_rows, random_state, first_id=1):
+    """Resample [template] passengers and give them new names, tickets and
+    cabins, so that last name, ticket and cabin cardinality grow with [n_rows]
+    roughly as they do in the Kaggle files.
+    """
+    rng = np.random.RandomState(random_state)
+    rows = template.sample(n_rows, replace=True, random_state=rng).reset_index(drop=True)
+
+    names = rows.Name.str.split(',', n=1, expand=True)
+    families = rng.randint(0, max(2 * n_rows // 3, 1), n_rows).astype(str)
+    tickets = rng.randint(0, max(int(n_rows * 0.71), 1), n_rows).astype(str)
+    cabin_numbers = rng.randint(1, 150, n_rows).astype(str)
+
+    return rows.assign(
+        PassengerId=np.arange(first_id, first_id + n_rows),
+        Name=names[0] + families + ',' + names[1],
+        Ticket=pd.Series(tickets).radd('T'),
+        Cabin=rows.Cabin.str[:1] + cabin_numbers)
+
+
+def write_dataset(scale, directory, random_state=0):
+    """Write train.csv/test.csv at [scale] times the Kaggle size.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    train = pd.read_csv('data/train.csv')
+    test = pd.read_csv('data/test.csv')
+    train_rows, test_rows = TRAIN_ROWS * scale, TEST_ROWS * scale
+
+    train_file_name = os.path.join(directory, 'train.csv')
+    test_file_name = os.path.join(directory, 'test.csv')
+    synthetic_passengers(train, train_rows, random_state).to_csv(train_file_name, index=False)
+    synthetic_passengers(test, test_rows, random_state + 1, first_id=train_rows + 1).to_csv(
+        test_file_name, index=False)
+
+    return train_file_name, test_file_name
+
+
+class Benchmark:
+    """Runs every scale twice: a timed pass without any memory tracing, then a
+    memory pass sampling the resident memory of the process and its workers
+    (instrumentation.RssSampler), so that tracing never inflates the times.
+    """
+
+    def __init__(self, verbose=1):
+        self.tracer = Tracer(verbose=verbose)
+        self.memory_tracer = Tracer(rss=True, verbose=verbose)
+
+    @property
+    def results(self):
+        memory = dict(((event['scale'], event['stage']), event)
+                      for event in self.memory_tracer.events if event['depth'] == 0)
+        return [dict(event, peak_mb=memory[(event['scale'], event['stage'])]['peak_rss_mb'],
+                     increase_mb=memory[(event['scale'], event['stage'])].get('rss_increase_mb'))
+                for event in self.tracer.events if event['depth'] == 0]
+
+    def run(self, scale, directory, impute_method='chained', sparse=True):
+        if not sparse and scale > MAX_DENSE_SCALE:
+            print('Skipping {0}x: dense encoding is only run up to {1}x'.format(scale, MAX_DENSE_SCALE))
+            return None
+
+        file_names = write_dataset(scale, directory)
+        for tracer in [self.tracer, self.memory_tracer]:
+            self.run_stages(tracer, scale, directory, file_names, impute_method, sparse)
+
+        return None
+
+    def run_stages(self, tracer, scale, directory, file_names, impute_method='chained', sparse=True):
+        """The production pipeline (main.pre_process_data), model fits and
+        ensembles, traced by [tracer].
+        """
+        first = len(tracer.events)
+        train_x, train_y, test_x = main.pre_process_data(sparse=sparse, impute_method=impute_method, tracer=tracer,
+                                                         file_names=file_names)
+        for event in tracer.events[first:]:
+            event['scale'] = scale
+
+        titanic_classifier = main.append_default_models(SurvivalClassifier(train_x, train_y, test_x, verbose=0,
+                                                                             tracer=tracer))
+        for model, model_name in zip(titanic_classifier.models, titanic_classifier.model_names):
+            with tracer.stage('fit {0}'.format(model_name), scale=scale):
+                model.fit(titanic_classifier.train_x, titanic_classifier.train_y)
+
+        with tracer.stage('voting', scale=scale):
+            titanic_classifier.voting()
+        with tracer.stage('blending', scale=scale):
+            titanic_classifier.blending()
+        with tracer.stage('flush_result', scale=scale):
+            titanic_classifier.flush_result(os.path.join(directory, 'result.csv'))
+
+        return None
+
+    def save(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.results, f, indent=2)
+
+        return None
+
+    def compare(self, baseline_file_name, tolerance=0.1):
+        """Print the time and memory ratio of every stage against a stored
+        baseline, flagging stages more than [tolerance] slower. Memory is
+        compared on the resident memory a stage adds (increase_mb), since the
+        absolute peak is dominated by whatever earlier stages left behind.
+        """
+        with open(baseline_file_name) as f:
+            baseline = dict(((result['scale'], result['stage']), result) for result in json.load(f))
+
+        for result in self.results:
+            previous = baseline.get((result['scale'], result['stage']))
+            if previous is None:
+                continue
+
+            time_ratio = result['seconds'] / max(previous['seconds'], 1e-9)
+            # One extra MB on both sides keeps stages that allocate nothing comparable
+            memory_ratio = (result['increase_mb'] + 1.0) / (previous['increase_mb'] + 1.0)
+            print('{0}x {1}: time x{2:.2f}, memory x{3:.2f}{4}'.format(
+                result['scale'], result['stage'], time_ratio, memory_ratio,
+                ' REGRESSION' if time_ratio > 1 + tolerance else ''))
+
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100, 1000])
+    parser.add_argument('--directory', default='temp/benchmark')
+    parser.add_argument('--impute-method', default='chained')
+    parser.add_argument('--dense', action='store_true',
+                        help='Dense dummy encoding, skipped above {0}x'.format(MAX_DENSE_SCALE))
+    parser.add_argument('--output', default='temp/benchmark/results.json')
+    parser.add_argument('--baseline')
+    args = parser.parse_args()
+
+    benchmark = Benchmark()
+    for scale in args.scales:
+        benchmark.run(scale, os.path.join(args.directory, '{0}x'.format(scale)), impute_method=args.impute_method,
+                      sparse=not args.dense)
+    benchmark.save(args.output)
+
+    if args.baseline:
+        benchmark.compare(args.baseline)
@@ -0,0 +1,103 @@
+from scipy.stats import rankdata
+
+import registry
+
+import numpy as np
+
+
+# Every combiner works on (members x rows) arrays: [predictions] of 0/1 labels
+# and [proba] of positive class probabilities, one row per ensemble member, so
+# that a vote over any number of members is a single matrix operation.
+
+
+# Votes whose label for a row does not depend on the other rows scored with it,
+# and so can be used to score passengers batch by batch. rank_average ranks the
+# rows against each other and needs the whole set at once.
+ROW_WISE_VOTING = ('hard', 'soft')
+
+
+def stack_members(members):
+    """(members x rows) predictions and probabilities of a list of
+    {'predictions', 'proba'} dicts; the probabilities are None unless every
+    member has them.
+    """
+    predictions = np.vstack([member['predictions'] for member in members])
+    if any(member['proba'] is None for member in members):
+        return predictions, None
+    return predictions, np.vstack([member['proba'] for member in members])
+
+
+def member_weights(n_members, weights=None):
+    return np.ones(n_members) if weights is None else np.asarray(weights, dtype=np.float64)
+
+
+def hard_vote(predictions, weights=None):
+    """Weighted majority of the member labels. Ties go to class 0, as in
+    sklearn's VotingClassifier.
+    """
+    weights = member_weights(predictions.shape[0], weights)
+    return (weights.dot(predictions) > weights.sum() / 2.0).astype(int)
+
+
+def soft_vote(proba, weights=None):
+    """Weighted mean of the member probabilities, thresholded at 0.5.
+    """
+    weights = member_weights(proba.shape[0], weights)
+    return (weights.dot(proba) / weights.sum() > 0.5).astype(int)
+
+
+def rank_average(proba, weights=None):
+    """Weighted mean of each member's rank of the rows, which ignores how
+    differently the members' probabilities are calibrated. The rows are ordered
+    by their mean rank, and as many as the soft vote calls survivors are
+    predicted to survive. Both depend on the whole set of rows, so it is not a
+    ROW_WISE_VOTING.
+    """
+    weights = member_weights(proba.shape[0], weights)
+    ranks = weights.dot(rankdata(proba, axis=1)) / weights.sum()
+    n_positive = int(np.sum(weights.dot(proba) / weights.sum() > 0.5))
+
+    result = np.zeros(proba.shape[1], dtype=int)
+    result[np.argsort(-ranks, kind='mergesort')[:n_positive]] = 1
+    return result
+
+
+def combine(predictions, proba, weights=None, voting='hard'):
+    """Weighted vote over the members of a binary ensemble; [voting] is
+    'hard', 'soft' or 'rank' (see rank_average).
+    """
+    if voting == 'hard':
+        return hard_vote(predictions, weights)
+    if voting not in ('soft', 'rank'):
+        raise ValueError('Unknown voting: {0}'.format(voting))
+    if proba is None:
+        raise ValueError('{0} voting needs predict_proba on every member'.format(voting.capitalize()))
+    return soft_vote(proba, weights) if voting == 'soft' else rank_average(proba, weights)
+
+
+def blend(train_proba, train_y, test_proba, blender=None):
+    """Learned combiner: fit [blender] (an MLP by default) on the members'
+    held-out probabilities of the training rows and predict the test rows.
+    """
+    blender = registry.create('model', 'mlp', hidden_layer_sizes=300) if blender is None else blender
+    blender.fit(np.asarray(train_proba).T, train_y)
+
+    return blender.predict(np.asarray(test_proba).T)
+
+
+def write_submission(file_name, passenger_ids, survived, chunk_size=100000):
+    """Write a PassengerId/Survived CSV in one pass, formatting [chunk_size]
+    rows at a time into a single buffered write.
+    """
+    passenger_ids = np.asarray(passenger_ids)
+    survived = np.asarray(survived).astype(int)
+    if len(passenger_ids) != len(survived):
+        raise ValueError('{0} passenger ids for {1} predictions'.format(len(passenger_ids), len(survived)))
+
+    with open(file_name, 'w', buffering=1 << 20) as f:
+        f.write('PassengerId,Survived\n')
+        for start in range(0, len(survived), chunk_size):
+            rows = zip(passenger_ids[start:start + chunk_size].tolist(), survived[start:start + chunk_size].tolist())
+            f.write(''.join('{0},{1}\n'.format(passenger_id, value) for passenger_id, value in rows))
+
+    return None
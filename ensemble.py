@@ -0,0 +1,87 @@
+from sklearn.base import clone
+from fold_cache import model_key, data_fingerprint
+from instrumentation import Tracer
+from combiners import combine, stack_members
+
+import itertools
+import numpy as np
+
+
+class FittedEnsemble:
+    """Ensemble members that are fitted once, with their test set predictions
+    and probabilities kept, so that re-weighting and switching between hard and
+    soft voting never refit anything. Members are identified by their class and
+    hyper parameters; fitting a list that contains already fitted members only
+    trains the new ones.
+    """
+
+    def __init__(self, fold_cache=None, tracer=None):
+        self.fold_cache = fold_cache
+        self.tracer = Tracer() if tracer is None else tracer
+        self.names = []
+        self.keys = []
+        self._data = None
+        self._members = {}
+
+    def fit(self, models, names, train_x, train_y, test_x):
+        # Fitted members are only valid for the data they were trained on
+        fingerprint = data_fingerprint(train_x, train_y, test_x)
+        if self._data != fingerprint:
+            self._data = fingerprint
+            self._members = {}
+
+        self.names = list(names)
+        self.keys = [model_key(model) for model in models]
+
+        for name, key, model in zip(self.names, self.keys, models):
+            if key not in self._members:
+                with self.tracer.stage('fit', model=name):
+                    estimator = clone(model).fit(train_x, train_y)
+                with self.tracer.stage('predict', model=name):
+                    has_proba = hasattr(estimator, 'predict_proba')
+                    self._members[key] = {
+                        'estimator': estimator,
+                        'predictions': estimator.predict(test_x),
+                        'proba': estimator.predict_proba(test_x)[:, 1] if has_proba else None
+                    }
+
+        return self
+
+    @property
+    def estimators(self):
+        return [self._members[key]['estimator'] for key in self.keys]
+
+    def predict(self, voting='hard', weights=None):
+        return combine(*stack_members([self._members[key] for key in self.keys]),
+                       weights=weights, voting=voting)
+
+    def search_weights(self, models, train_y, candidates=(0, 1, 2, 3), voting='hard', n_folds=5):
+        """Score every combination of [candidates] weights against the
+        out-of-fold predictions in the fold cache, as one matrix product.
+        Returns the best weights and their accuracy.
+        """
+        self.fold_cache.fit_folds(models, n_folds)
+        out_of_fold = []
+        for model in models:
+            results = self.fold_cache.folds(model, n_folds)
+            has_proba = all(result['proba'] is not None for result in results)
+            member = {'predictions': np.zeros(len(train_y), dtype=int),
+                      'proba': np.zeros(len(train_y)) if has_proba else None}
+            for result in results:
+                member['predictions'][result['test']] = result['predictions']
+                if has_proba:
+                    member['proba'][result['test']] = result['proba']
+            out_of_fold.append(member)
+
+        predictions, proba = stack_members(out_of_fold)
+        grid = np.array([w for w in itertools.product(candidates, repeat=len(models)) if any(w)],
+                        dtype=np.float64)
+
+        if voting == 'hard':
+            votes = grid.dot(predictions) > grid.sum(axis=1)[:, None] / 2.0
+        else:
+            votes = grid.dot(proba) / grid.sum(axis=1)[:, None] > 0.5
+        scores = np.mean(votes == np.asarray(train_y)[None, :], axis=1)
+
+        best = int(np.argmax(scores))
+        return grid[best].tolist(), scores[best]
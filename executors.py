@@ -0,0 +1,286 @@
+"""Task executors for the fold and search fits of SurvivalClassifier.
+
+An executor runs a module level function over a list of keyword argument
+dicts, all sharing the same data arrays: executor.map(function, tasks, **data).
+LocalExecutor uses joblib on this machine; SocketExecutor sends the tasks to
+worker processes on other nodes, started with
+
+    TITANIC_WORKER_AUTHKEY_FILE=~/.titanic-authkey python executors.py --port 6000 --processes 4
+
+(one process per core, on ports 6000-6003) from a checkout of this repository.
+Workers unpickle and run whatever an authenticated driver sends them, so both
+sides need the same secret key (see read_authkey) and there is no default.
+Workers bind to 127.0.0.1 unless --host says otherwise; only expose them on a
+trusted network, e.g. through an SSH tunnel.
+"""
+from multiprocessing.connection import Client, Listener
+from joblib import Parallel, delayed
+
+import argparse
+import hashlib
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import traceback
+
+AUTHKEY_ENV = 'TITANIC_WORKER_AUTHKEY'
+AUTHKEY_FILE_ENV = 'TITANIC_WORKER_AUTHKEY_FILE'
+
+
+def read_authkey(authkey=None, file_name=None):
+    """The shared worker secret: [authkey] itself, else the contents of
+    [file_name], else the TITANIC_WORKER_AUTHKEY variable, else the file named
+    by TITANIC_WORKER_AUTHKEY_FILE. Raises ValueError when none is set.
+    """
+    if authkey is None and not file_name:
+        authkey = os.environ.get(AUTHKEY_ENV)
+        file_name = os.environ.get(AUTHKEY_FILE_ENV)
+    if not authkey and file_name:
+        with open(os.path.expanduser(file_name), 'rb') as f:
+            authkey = f.read().strip()
+
+    if not authkey:
+        raise ValueError('No worker authkey: pass one, or set {0} or {1}'.format(AUTHKEY_ENV, AUTHKEY_FILE_ENV))
+    return authkey.encode() if isinstance(authkey, str) else authkey
+
+
+class LocalExecutor:
+    """In-process joblib pool; arrays larger than [max_nbytes] are
+    memory-mapped into the workers.
+    """
+
+    def __init__(self, n_jobs=-1, max_nbytes='1M', verbose=0):
+        self.n_jobs = n_jobs
+        self.max_nbytes = max_nbytes
+        self.verbose = verbose
+
+    def map(self, function, tasks, **data):
+        return Parallel(n_jobs=self.n_jobs, max_nbytes=self.max_nbytes, mmap_mode='r', verbose=self.verbose)(
+            delayed(function)(**dict(task, **data)) for task in tasks)
+
+
+class SocketExecutor:
+    """Runs tasks on remote workers (see serve) over authenticated
+    multiprocessing connections. The shared data is shipped to each worker
+    once per content hash and cached there; every worker connection is fed
+    from one task queue. A task whose worker disconnects, or does not answer
+    within [timeout] seconds, is put back on the queue for the others, and
+    whatever is left when no worker remains runs in-process through
+    [fallback] (a LocalExecutor by default). [authkey] is resolved with
+    read_authkey.
+    """
+
+    def __init__(self, addresses, authkey=None, timeout=None, fallback=None, verbose=0):
+        self.addresses = addresses
+        self.authkey = read_authkey(authkey)
+        self.timeout = timeout
+        self.fallback = LocalExecutor() if fallback is None else fallback
+        self.verbose = verbose
+
+        self.connections = {}
+
+    def connect(self):
+        """Open a connection to every worker that does not have one; workers
+        that cannot be reached are skipped.
+        """
+        for address in self.addresses:
+            if address in self.connections:
+                continue
+            try:
+                self.connections[address] = Client(address, authkey=self.authkey)
+            except OSError as error:
+                self.log('Worker {0} unreachable: {1}'.format(address, error), 1)
+
+        return list(self.connections.items())
+
+    def map(self, function, tasks, **data):
+        if not tasks:
+            return []
+
+        payload = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        digest = hashlib.sha1(payload).hexdigest()
+
+        pending = queue.Queue()
+        for index in range(len(tasks)):
+            pending.put(index)
+        results = [None] * len(tasks)
+        errors = []
+        finished = threading.Event()
+        state = {'done': 0}
+        lock = threading.Lock()
+
+        def feed(address, connection):
+            try:
+                connection.send(('has', digest))
+                if not self._receive(connection):
+                    connection.send(('data', digest, payload))
+
+                while not finished.is_set():
+                    try:
+                        index = pending.get(timeout=0.1)
+                    except queue.Empty:
+                        continue
+
+                    try:
+                        connection.send(('task', index, function, digest, tasks[index]))
+                        status, _, value = self._receive(connection)
+                    except Exception:
+                        pending.put(index)
+                        raise
+
+                    with lock:
+                        if status == 'error':
+                            errors.append(value)
+                        results[index] = value
+                        state['done'] += 1
+                        if state['done'] == len(tasks) or errors:
+                            finished.set()
+            except (EOFError, OSError, TimeoutError) as error:
+                self.log('Lost worker {0}: {1!r}'.format(address, error), 1)
+                self._drop(address)
+
+        threads = [threading.Thread(target=feed, args=connection) for connection in self.connect()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise RuntimeError('Remote task failed:\n{0}'.format(errors[0]))
+
+        remaining = []
+        while not pending.empty():
+            remaining.append(pending.get())
+        if remaining:
+            self.log('No workers left, running {0} tasks in-process'.format(len(remaining)), 1)
+            for index, value in zip(remaining, self.fallback.map(function, [tasks[i] for i in remaining], **data)):
+                results[index] = value
+
+        return results
+
+    def _receive(self, connection):
+        if self.timeout is not None and not connection.poll(self.timeout):
+            raise TimeoutError('no answer within {0}s'.format(self.timeout))
+        return connection.recv()
+
+    def _drop(self, address):
+        connection = self.connections.pop(address, None)
+        if connection is not None:
+            connection.close()
+
+        return None
+
+    def close(self):
+        for address, connection in list(self.connections.items()):
+            try:
+                connection.send(('close',))
+            except OSError:
+                pass
+            self._drop(address)
+
+        return None
+
+    def log(self, msg, verbose):
+        if self.verbose >= verbose:
+            print(msg)
+
+        return None
+
+
+def handle(connection, datasets, max_datasets):
+    """Answer one driver connection until it closes.
+    """
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return None
+
+        if message[0] == 'has':
+            connection.send(message[1] in datasets)
+        elif message[0] == 'data':
+            datasets[message[1]] = pickle.loads(message[2])
+            while len(datasets) > max_datasets:
+                datasets.pop(next(iter(datasets)))
+        elif message[0] == 'task':
+            _, index, function, digest, task = message
+            try:
+                connection.send(('result', index, function(**dict(task, **datasets[digest]))))
+            except Exception:
+                connection.send(('error', index, traceback.format_exc()))
+        else:
+            connection.close()
+            return None
+
+
+def serve(address, authkey=None, max_datasets=4, ready=None):
+    """Worker loop: accept driver connections authenticated with [authkey]
+    (see read_authkey) on [address] and run their tasks, keeping the
+    [max_datasets] most recently shipped data sets. The bound address is put on
+    the [ready] queue, if given.
+    """
+    listener = Listener(address, authkey=read_authkey(authkey))
+    if ready is not None:
+        ready.put(listener.address)
+
+    datasets = {}
+    while True:
+        connection = listener.accept()
+        threading.Thread(target=handle, args=(connection, datasets, max_datasets), daemon=True).start()
+
+
+class LocalCluster:
+    """[n_workers] worker processes on this machine standing in for nodes,
+    for trying out SocketExecutor without a cluster. They share a random
+    authkey unless one is given.
+    """
+
+    def __init__(self, n_workers=2, authkey=None):
+        self.authkey = os.urandom(32) if authkey is None else read_authkey(authkey)
+        authkey = self.authkey
+        ready = multiprocessing.Queue()
+        self.processes = [multiprocessing.Process(target=serve, args=(('127.0.0.1', 0), authkey, 4, ready),
+                                                  daemon=True)
+                          for _ in range(n_workers)]
+        for process in self.processes:
+            process.start()
+        self.addresses = [ready.get() for _ in self.processes]
+
+    def executor(self, **options):
+        return SocketExecutor(self.addresses, authkey=self.authkey, **options)
+
+    def close(self):
+        for process in self.processes:
+            process.terminate()
+            process.join()
+
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Start search worker processes.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6000)
+    parser.add_argument('--processes', type=int, default=1)
+    parser.add_argument('--authkey-file', help='file holding the shared secret (or set {0} / {1})'.format(
+        AUTHKEY_ENV, AUTHKEY_FILE_ENV))
+    args = parser.parse_args()
+
+    try:
+        authkey = read_authkey(file_name=args.authkey_file)
+    except ValueError as error:
+        parser.error(str(error))
+    workers = [multiprocessing.Process(target=serve, args=((args.host, args.port + i), authkey))
+               for i in range(args.processes)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
@@ -0,0 +1,134 @@
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold
+from joblib import Parallel, delayed
+
+from fold_cache import model_key, data_fingerprint
+
+import numpy as np
+
+
+def importances(estimator):
+    """Per-feature importance of a fitted linear or tree model.
+    """
+    if hasattr(estimator, 'coef_'):
+        return np.abs(np.atleast_2d(np.asarray(estimator.coef_))).sum(axis=0)
+    if hasattr(estimator, 'feature_importances_'):
+        return np.asarray(estimator.feature_importances_)
+    raise ValueError('{0} exposes neither coef_ nor feature_importances_'.format(type(estimator).__name__))
+
+
+def elimination_path(model, x, y, train, test, start, counts):
+    """Recursive feature elimination for one fold. Starting from the features in
+    [start], fit on the [train] rows, score on the [test] rows, then keep the
+    next (smaller) entry of [counts] most important features and repeat.
+    Returns the score at every count and the fold's ranking of [start], most
+    important first.
+    """
+    x_train, y_train, x_test, y_test = x[train], y[train], x[test], y[test]
+    remaining = np.asarray(start)
+    eliminated = []
+    scores = {}
+
+    for count in counts:
+        eliminated.append(remaining[count:])
+        remaining = remaining[:count]
+
+        estimator = clone(model).fit(x_train[:, remaining], y_train)
+        scores[count] = estimator.score(x_test[:, remaining], y_test)
+        remaining = remaining[np.argsort(-importances(estimator), kind='mergesort')]
+
+    ranking = np.concatenate([remaining] + eliminated[::-1])
+    return scores, ranking
+
+
+def coarse_counts(n_features, step, min_features):
+    """Feature counts that shrink by the fraction [step] each time.
+    """
+    counts = [n_features]
+    while counts[-1] > min_features:
+        counts.append(max(min(int(counts[-1] * (1 - step)), counts[-1] - 1), min_features))
+    return counts
+
+
+class FeatureSelector:
+    """Cross-validated recursive feature elimination with a coarse-to-fine step
+    schedule. A first pass removes a [step] fraction of the remaining features
+    at a time; a second pass, started from each fold's cached ranking instead of
+    the full feature set, removes [fine_step] features at a time within
+    [window] of the best coarse count. All (model, fold) paths of a pass run in
+    parallel, and fold rankings are cached per model and data set.
+    """
+
+    def __init__(self, cv=5, step=0.25, fine_step=1, window=0.25, min_features=1, n_jobs=-1, verbose=0):
+        self.cv = cv
+        self.step = step
+        self.fine_step = fine_step
+        self.window = window
+        self.min_features = min_features
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+
+        self.rankings_ = {}
+        self.scores_ = {}
+
+    def select(self, models, names, x, y):
+        """Return one boolean feature mask per model.
+        """
+        fingerprint = data_fingerprint(x, y)
+        n_features = x.shape[1]
+        splits = list(StratifiedKFold(n_splits=self.cv).split(x, y))
+        keys = [(model_key(model), fingerprint, self.cv) for model in models]
+
+        coarse = coarse_counts(n_features, self.step, self.min_features)
+        tasks = [(index, fold) for index in range(len(models)) for fold in range(len(splits))
+                 if (keys[index], fold) not in self.rankings_]
+        results = Parallel(n_jobs=self.n_jobs)(
+            delayed(elimination_path)(models[index], x, y, splits[fold][0], splits[fold][1],
+                                      np.arange(n_features), coarse)
+            for index, fold in tasks)
+        for (index, fold), (scores, ranking) in zip(tasks, results):
+            self.rankings_[(keys[index], fold)] = ranking
+            self.scores_[(keys[index], fold)] = scores
+
+        fine_tasks = []
+        for index, key in enumerate(keys):
+            best = self._best_count(key, len(splits))
+            upper = min(int(best * (1 + self.window)) + 1, n_features)
+            lower = max(int(best * (1 - self.window)), self.min_features)
+            fine = list(range(upper, lower - 1, -self.fine_step))
+            fine_tasks.extend((index, fold, fine) for fold in range(len(splits)))
+
+        results = Parallel(n_jobs=self.n_jobs)(
+            delayed(elimination_path)(models[index], x, y, splits[fold][0], splits[fold][1],
+                                      self.rankings_[(keys[index], fold)][:fine[0]], fine)
+            for index, fold, fine in fine_tasks)
+        for (index, fold, fine), (scores, ranking) in zip(fine_tasks, results):
+            self.scores_[(keys[index], fold)].update(scores)
+
+        masks = []
+        for name, key in zip(names, keys):
+            best = self._best_count(key, len(splits))
+            positions = np.zeros(n_features)
+            for fold in range(len(splits)):
+                positions[self.rankings_[(key, fold)]] += np.arange(n_features)
+
+            mask = np.zeros(n_features, dtype=bool)
+            mask[np.argsort(positions, kind='mergesort')[:best]] = True
+            masks.append(mask)
+            self.log('{0}: {1} of {2} features selected'.format(name, best, n_features), 1)
+
+        return masks
+
+    def _best_count(self, key, n_folds):
+        """Feature count with the best mean fold score; fewer features win ties.
+        """
+        counts = set.intersection(*[set(self.scores_[(key, fold)]) for fold in range(n_folds)])
+        mean_scores = dict((count, np.mean([self.scores_[(key, fold)][count] for fold in range(n_folds)]))
+                           for count in counts)
+        return max(sorted(mean_scores), key=lambda count: (mean_scores[count], -count))
+
+    def log(self, msg, verbose):
+        if self.verbose >= verbose:
+            print(msg)
+
+        return None
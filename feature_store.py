@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+
+def cache_key(input_files, version, **options):
+    """Hash the contents of the input files together with the feature pipeline
+    version and any options that change the engineered output.
+    """
+    digest = hashlib.sha1()
+    digest.update(str(version).encode())
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    for file_name in input_files:
+        with open(file_name, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _save_frame(path, name, data):
+    """Store a feature DataFrame as one block per dtype plus a codes array for
+    each categorical column and its index (the PassengerIds). Returns the
+    column layout needed to rebuild it.
+    """
+    sparse_cols = [col for col in data if isinstance(data[col].dtype, pd.CategoricalDtype)]
+    dense_cols = [col for col in data if col not in sparse_cols]
+
+    blocks = []
+    for dtype in sorted(set(data[col].dtype.str for col in dense_cols)):
+        columns = [col for col in dense_cols if data[col].dtype.str == dtype]
+        np.save(os.path.join(path, '{0}_block{1}.npy'.format(name, len(blocks))),
+                np.ascontiguousarray(data[columns], dtype=dtype))
+        blocks.append(columns)
+
+    for col in sparse_cols:
+        np.save(os.path.join(path, '{0}_{1}.npy'.format(name, col)), np.asarray(data[col].cat.codes))
+    np.save(os.path.join(path, '{0}_index.npy'.format(name)), np.asarray(data.index))
+
+    return {
+        'columns': list(data),
+        'blocks': blocks,
+        'categories': {col: list(data[col].cat.categories) for col in sparse_cols}
+    }
+
+
+def _load_frame(path, name, layout):
+    row_index = np.load(os.path.join(path, '{0}_index.npy'.format(name)))
+    blocks = [pd.DataFrame(np.load(os.path.join(path, '{0}_block{1}.npy'.format(name, index)), mmap_mode='r'),
+                           columns=columns, index=row_index, copy=False)
+              for index, columns in enumerate(layout['blocks'])]
+    if len(blocks) == 1 and not layout['categories']:
+        return blocks[0]
+
+    data = pd.concat(blocks, axis=1) if blocks else pd.DataFrame(index=row_index)
+    for col, categories in layout['categories'].items():
+        codes = np.load(os.path.join(path, '{0}_{1}.npy'.format(name, col)), mmap_mode='r')
+        data[col] = pd.Categorical.from_codes(codes, categories=categories)
+    return data[layout['columns']]
+
+
+def save_features(directory, key, train_x, train_y, test_x):
+    """Write the output of pre_process_data under [directory]/[key]. The entry is
+    built in a scratch directory and renamed into place, so an interrupted run
+    never leaves a half-written entry behind.
+    """
+    path = os.path.join(directory, key)
+    scratch = path + '.tmp'
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+
+    np.save(os.path.join(scratch, 'train_y.npy'), np.asarray(train_y))
+    layout = {
+        'train_x': _save_frame(scratch, 'train_x', train_x),
+        'test_x': _save_frame(scratch, 'test_x', test_x)
+    }
+    with open(os.path.join(scratch, 'layout.json'), 'w') as f:
+        json.dump(layout, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(scratch, path)
+
+    return None
+
+
+def load_features(directory, key):
+    """Memory-map a stored feature set. Returns None when [key] is not cached.
+    """
+    path = os.path.join(directory, key)
+    layout_file = os.path.join(path, 'layout.json')
+    if not os.path.isfile(layout_file):
+        return None
+
+    with open(layout_file) as f:
+        layout = json.load(f)
+
+    train_x = _load_frame(path, 'train_x', layout['train_x'])
+    train_y = np.load(os.path.join(path, 'train_y.npy'), mmap_mode='r')
+    test_x = _load_frame(path, 'test_x', layout['test_x'])
+
+    return train_x, train_y, test_x
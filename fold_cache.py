@@ -0,0 +1,222 @@
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold, ShuffleSplit
+from scipy import sparse
+from joblib import effective_n_jobs
+
+from executors import LocalExecutor
+
+import hashlib
+import numpy as np
+
+
+def as_contiguous(x, dtype=np.float64):
+    """C-contiguous dense array, or CSR matrix with sorted indices, of [dtype].
+    """
+    if x is None:
+        return None
+    if sparse.issparse(x):
+        x = sparse.csr_matrix(x, dtype=dtype)
+        x.sort_indices()
+        return x
+    return np.ascontiguousarray(x, dtype=dtype)
+
+
+def data_fingerprint(*arrays):
+    """Content hash of dense arrays and/or sparse matrices.
+    """
+    digest = hashlib.sha1()
+    for x in arrays:
+        if x is None:
+            digest.update(b'None')
+        elif sparse.issparse(x):
+            x = sparse.csr_matrix(x)
+            digest.update(repr(x.shape).encode())
+            for part in (x.data, x.indices, x.indptr):
+                digest.update(np.ascontiguousarray(part).view(np.uint8))
+        else:
+            x = np.ascontiguousarray(x)
+            digest.update(repr((x.shape, x.dtype.str)).encode())
+            digest.update(x.view(np.uint8))
+    return digest.hexdigest()
+
+
+def model_key(model):
+    """Identify an estimator by its class and hyper parameters.
+    """
+    params = sorted(model.get_params(deep=False).items())
+    return type(model).__name__, repr(params)
+
+
+def fit_fold(model, train_x, train_y, test_x, train, test, keep_estimator=False):
+    """Fit [model] on the [train] rows and predict the [test] rows and the test
+    set. Module level so that it can run in a worker process. The fitted
+    estimator is only sent back if [keep_estimator], since a large forest costs
+    tens of megabytes per fold to pickle and to cache.
+    """
+    estimator = model.fit(train_x[train], train_y[train])
+    has_proba = hasattr(estimator, 'predict_proba')
+
+    return {
+        'train': train,
+        'test': test,
+        'predictions': estimator.predict(train_x[test]),
+        'proba': estimator.predict_proba(train_x[test])[:, 1] if has_proba else None,
+        'test_proba': estimator.predict_proba(test_x)[:, 1] if has_proba and test_x is not None else None,
+        'estimator': estimator if keep_estimator else None
+    }
+
+
+def fit_size(model, train_x, train_y, train, test, size):
+    """Fit [model] on the first [size] rows of the [train] fold and score it on
+    those rows and on the [test] rows, as sklearn's learning_curve does.
+    """
+    subset = train[:size]
+    estimator = model.fit(train_x[subset], train_y[subset])
+
+    return estimator.score(train_x[subset], train_y[subset]), estimator.score(train_x[test], train_y[test])
+
+
+class FoldCache:
+    """Fold indices, contiguous copies of the data and per-fold fits shared by
+    every reporting and ensembling method of SurvivalClassifier. A given
+    (model parameters, fold scheme, fold) is only ever fitted once; its
+    out-of-fold predictions and test set probabilities are kept alongside it,
+    and the fitted estimator too if [keep_estimators] is set.
+    """
+
+    def __init__(self, train_x, train_y, test_x=None, dtype=np.float64, random_state=50,
+                 keep_estimators=False, executor=None):
+        self.train_x = as_contiguous(train_x, dtype)
+        self.train_y = np.ascontiguousarray(train_y)
+        self.test_x = as_contiguous(test_x, dtype)
+        self.random_state = random_state
+        self.keep_estimators = keep_estimators
+        self.executor = executor
+
+        self._splits = {}
+        self._folds = {}
+        self._curves = {}
+
+    def splits(self, n_folds=5, kind='stratified', test_size=0.2, random_state=None):
+        """Memoized list of (train, test) index arrays. kind is 'stratified'
+        (StratifiedKFold) or 'shuffle' (ShuffleSplit).
+        """
+        random_state = self.random_state if random_state is None else random_state
+        key = (kind, n_folds, test_size, random_state)
+
+        if key not in self._splits:
+            if kind == 'stratified':
+                cv = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=random_state)
+            elif kind == 'shuffle':
+                cv = ShuffleSplit(n_splits=n_folds, test_size=test_size, random_state=random_state)
+            else:
+                raise ValueError('Unknown fold scheme: {0}'.format(kind))
+            self._splits[key] = list(cv.split(self.train_x, self.train_y))
+
+        return self._splits[key]
+
+    def fold(self, model, n_folds=5, fold_index=0, **split_options):
+        """Fit [model] on one training fold, or return the cached result. The
+        result holds the fold indices, out-of-fold predictions/probabilities,
+        test set probabilities and (if keep_estimators) the fitted estimator.
+        """
+        train, test = self.splits(n_folds, **split_options)[fold_index]
+        key = self._fold_key(model, n_folds, fold_index, split_options)
+
+        if key not in self._folds:
+            self._folds[key] = fit_fold(clone(model), self.train_x, self.train_y, self.test_x, train, test,
+                                        self.keep_estimators)
+
+        return self._folds[key]
+
+    def fit_folds(self, models, n_folds=5, n_jobs=-1, batch_size=None, max_nbytes='1M', **split_options):
+        """Fit every (model, fold) pair that is not cached yet on a process pool,
+        or on the cache's executor (see executors) if it has one. Arrays larger
+        than [max_nbytes] are memory-mapped into the workers instead of being
+        pickled for every task, and tasks are dispatched in batches of
+        [batch_size] whose results are stored as soon as the batch finishes,
+        which bounds the number of fitted estimators in flight.
+        """
+        splits = self.splits(n_folds, **split_options)
+        tasks = [(model, i) for model in models for i in range(len(splits))
+                 if self._fold_key(model, n_folds, i, split_options) not in self._folds]
+        if not tasks:
+            return None
+
+        executor = self.executor or LocalExecutor(n_jobs=n_jobs, max_nbytes=max_nbytes)
+        batch_size = batch_size or 2 * effective_n_jobs(n_jobs)
+        for start in range(0, len(tasks), batch_size):
+            batch = tasks[start:start + batch_size]
+            results = executor.map(
+                fit_fold, [{'model': clone(model), 'train': splits[i][0], 'test': splits[i][1],
+                            'keep_estimator': self.keep_estimators} for model, i in batch],
+                train_x=self.train_x, train_y=self.train_y, test_x=self.test_x)
+
+            for (model, i), result in zip(batch, results):
+                self._folds[self._fold_key(model, n_folds, i, split_options)] = result
+
+        return None
+
+    def folds(self, model, n_folds=5, **split_options):
+        return [self.fold(model, n_folds, i, **split_options)
+                for i in range(len(self.splits(n_folds, **split_options)))]
+
+    def cross_val_score(self, model, n_folds=5, **split_options):
+        """Accuracy on each fold, computed from the cached predictions.
+        """
+        return np.array([np.mean(result['predictions'] == self.train_y[result['test']])
+                         for result in self.folds(model, n_folds, **split_options)])
+
+    def out_of_fold(self, model, n_folds=5):
+        """Out-of-fold probabilities for the training set, and the test set
+        probabilities averaged over the folds.
+        """
+        oof = np.zeros(self.train_x.shape[0])
+        test_proba = []
+        for result in self.folds(model, n_folds):
+            oof[result['test']] = result['proba']
+            test_proba.append(result['test_proba'])
+
+        return oof, np.mean(test_proba, axis=0)
+
+    def learning_curves(self, models, train_sizes=np.linspace(0.1, 1.0, 5), n_folds=10, n_jobs=-1,
+                        max_nbytes='1M', **split_options):
+        """Learning curves of all [models] at once: every (model, training size,
+        fold) fit that is not cached yet is dispatched to a single process pool
+        (or the cache's executor).
+        [train_sizes] are fractions of the training fold (floats) or row counts
+        (ints). Returns, per model, the row counts and the (sizes x folds) train
+        and test score arrays.
+        """
+        splits = self.splits(n_folds, **split_options)
+        n_train = len(splits[0][0])
+        sizes = np.unique([int(size * n_train) if isinstance(size, float) else int(size)
+                           for size in np.atleast_1d(train_sizes)])
+
+        tasks = [(model, size, i) for model in models for size in sizes for i in range(len(splits))
+                 if self._fold_key(model, n_folds, i, split_options) + (size,) not in self._curves]
+        executor = self.executor or LocalExecutor(n_jobs=n_jobs, max_nbytes=max_nbytes)
+        results = executor.map(
+            fit_size, [{'model': clone(model), 'train': splits[i][0], 'test': splits[i][1], 'size': size}
+                       for model, size, i in tasks],
+            train_x=self.train_x, train_y=self.train_y)
+        for (model, size, i), result in zip(tasks, results):
+            self._curves[self._fold_key(model, n_folds, i, split_options) + (size,)] = result
+
+        curves = []
+        for model in models:
+            scores = np.array([[self._curves[self._fold_key(model, n_folds, i, split_options) + (size,)]
+                                for i in range(len(splits))] for size in sizes])
+            curves.append((sizes, scores[:, :, 0], scores[:, :, 1]))
+
+        return curves
+
+    @staticmethod
+    def _fold_key(model, n_folds, fold_index, split_options):
+        return model_key(model), n_folds, tuple(sorted(split_options.items())), fold_index
+
+    def clear(self):
+        self._folds = {}
+        self._curves = {}
+
+        return None
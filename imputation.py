@@ -0,0 +1,140 @@
+from sklearn.linear_model import Ridge
+from sklearn.utils.extmath import randomized_svd
+from scipy import sparse
+
+import numpy as np
+import time
+
+
+class ColumnImputer:
+    """Chained-equation imputation restricted to the columns that actually have
+    missing values. The complete columns (mostly one-hot dummies) are only used
+    as predictors, through a low-rank projection computed once up front, so the
+    cost of each iteration depends on the number of incomplete columns rather
+    than on the width of the matrix.
+
+    method='mean' skips the modelling entirely and fills every column with its
+    mean in a single pass.
+    """
+
+    def __init__(self, method='chained', n_components=20, max_iter=10, tol=1e-3, alpha=1.0,
+                 columns=None, verbose=0):
+        self.method = method
+        self.n_components = n_components
+        self.max_iter = max_iter
+        self.tol = tol
+        self.alpha = alpha
+        self.columns = columns
+        self.verbose = verbose
+
+        self.means_ = None
+        self.missing_columns_ = []
+        self.complete_columns_ = []
+        self.components_ = None
+        self.models_ = {}
+        self.n_iter_ = 0
+        self.column_times_ = {}
+
+    def fit(self, x):
+        self._fit_transform(np.array(x, dtype=np.float64))
+        return self
+
+    def fit_transform(self, x):
+        return self._fit_transform(np.array(x, dtype=np.float64))
+
+    def transform(self, x):
+        filled = self._initial_fill(np.array(x, dtype=np.float64))
+        if self.method == 'mean' or not self.models_:
+            return filled
+
+        missing = np.isnan(np.asarray(x, dtype=np.float64))
+        projected = self._project(filled)
+        for _ in range(self.n_iter_):
+            for j in self.missing_columns_:
+                rows = missing[:, j]
+                if rows.any():
+                    design = self._design(projected, filled, j)
+                    filled[rows, j] = self.models_[j].predict(design[rows])
+
+        return filled
+
+    def report(self):
+        """Time spent imputing each column, slowest first.
+        """
+        return sorted(self.column_times_.items(), key=lambda item: -item[1])
+
+    def _fit_transform(self, x):
+        missing = np.isnan(x)
+        self.means_ = np.nan_to_num(np.nanmean(np.where(missing.all(axis=0), 0, x), axis=0))
+        self.missing_columns_ = list(np.flatnonzero(missing.any(axis=0)))
+        self.complete_columns_ = list(np.flatnonzero(~missing.any(axis=0)))
+        self.column_times_ = {}
+        self.models_ = {}
+
+        filled = self._initial_fill(x)
+        if self.method == 'mean' or not self.missing_columns_:
+            self.n_iter_ = 0
+            return filled
+
+        self.components_ = self._fit_projection(filled)
+        projected = self._project(filled)
+
+        for iteration in range(self.max_iter):
+            change = 0.0
+            for j in self.missing_columns_:
+                start = time.time()
+                rows = missing[:, j]
+                design = self._design(projected, filled, j)
+
+                model = Ridge(alpha=self.alpha).fit(design[~rows], x[~rows, j])
+                predictions = model.predict(design[rows])
+                change += np.sum((predictions - filled[rows, j]) ** 2) / max(np.sum(filled[:, j] ** 2), 1e-12)
+
+                filled[rows, j] = predictions
+                self.models_[j] = model
+                self._add_time(j, time.time() - start)
+
+            self.n_iter_ = iteration + 1
+            self.log('Imputation iteration {0}: relative change {1}'.format(self.n_iter_, change), 2)
+            if change < self.tol:
+                break
+
+        for name, seconds in self.report():
+            self.log('Imputed {0} in {1:.3f}s'.format(name, seconds), 1)
+
+        return filled
+
+    def _initial_fill(self, x):
+        return np.where(np.isnan(x), self.means_, x)
+
+    def _fit_projection(self, filled):
+        if not self.complete_columns_:
+            return None
+
+        predictors = sparse.csr_matrix(filled[:, self.complete_columns_])
+        n_components = min(self.n_components, min(predictors.shape) - 1)
+        if n_components < 1 or n_components >= predictors.shape[1]:
+            return None
+
+        _, _, components = randomized_svd(predictors, n_components, random_state=0)
+        return components
+
+    def _project(self, filled):
+        predictors = filled[:, self.complete_columns_]
+        if self.components_ is None:
+            return predictors
+        return sparse.csr_matrix(predictors).dot(self.components_.T)
+
+    def _design(self, projected, filled, column):
+        others = [j for j in self.missing_columns_ if j != column]
+        return np.hstack([projected, filled[:, others]])
+
+    def _add_time(self, column, seconds):
+        name = self.columns[column] if self.columns is not None else column
+        self.column_times_[name] = self.column_times_.get(name, 0.0) + seconds
+
+    def log(self, msg, verbose):
+        if self.verbose >= verbose:
+            print(msg)
+
+        return None
@@ -0,0 +1,187 @@
+from sklearn.base import clone
+from scipy import sparse
+
+from titanic_classifier import to_model_matrix
+from prediction_service import SurvivalPredictor
+
+import joblib
+import numpy as np
+import pandas as pd
+
+
+def column_stats(x):
+    """Column means and standard deviations of a dense or sparse matrix.
+    """
+    if sparse.issparse(x):
+        mean = np.asarray(x.mean(axis=0)).ravel()
+        return mean, np.sqrt(np.maximum(np.asarray(x.multiply(x).mean(axis=0)).ravel() - mean ** 2, 0))
+    return x.mean(axis=0), x.std(axis=0)
+
+
+def mean_shift(x, mean, std):
+    """Average shift of the column means of [x] from [mean], in reference
+    standard deviations; constant reference columns are left out.
+    """
+    varying = std > 0
+    if not varying.any() or x.shape[0] == 0:
+        return 0.0
+    new_mean = column_stats(x)[0]
+    return float(np.mean(np.abs(new_mean[varying] - mean[varying]) / std[varying]))
+
+
+def update_estimator(estimator, x_new, y_new, x, y, tree_fraction=0.1, boosting_rounds=20,
+                     base_rounds=None, boosting_cap=2, random_state=None):
+    """Bring a fitted estimator up to date with new rows, in place where the
+    estimator allows it, and return it with how it was updated:
+
+    partial_fit models take a pass over the new rows; XGBoost boosts
+    [boosting_rounds] more rounds on all rows from its current booster, unless
+    that would take it past [boosting_cap] times its configured [base_rounds],
+    in which case it is refitted with [base_rounds]; warm start forests grow
+    [tree_fraction] more trees on all rows and retire as many of their oldest
+    trees, so their size stays constant. The new trees are seeded from
+    [random_state] (a RandomState), as a fixed integer seed would give every
+    update the same trees. Anything else is refitted on all rows.
+    """
+    params = estimator.get_params()
+    if hasattr(estimator, 'partial_fit'):
+        estimator.partial_fit(x_new, y_new)
+        return estimator, 'partial_fit'
+
+    if hasattr(estimator, 'get_booster') and base_rounds is not None and (
+            params['n_estimators'] + boosting_rounds > boosting_cap * base_rounds):
+        return estimator.set_params(n_estimators=base_rounds).fit(x, y), 'refit'
+
+    if hasattr(estimator, 'get_booster'):
+        booster = estimator.get_booster()
+        n_estimators = params['n_estimators']
+        estimator.set_params(n_estimators=boosting_rounds)
+        estimator.fit(x, y, xgb_model=booster, verbose=False)
+        estimator.set_params(n_estimators=n_estimators + boosting_rounds)
+        return estimator, 'boosting'
+
+    if 'warm_start' in params and hasattr(estimator, 'estimators_'):
+        n_trees = len(estimator.estimators_)
+        new_trees = max(int(np.ceil(n_trees * tree_fraction)), 1)
+        random_state = np.random.RandomState() if random_state is None else random_state
+        estimator.set_params(warm_start=True, n_estimators=n_trees + new_trees,
+                             random_state=random_state.randint(np.iinfo(np.int32).max))
+        estimator.fit(x, y)
+        estimator.estimators_ = estimator.estimators_[new_trees:]
+        estimator.set_params(warm_start=params['warm_start'], n_estimators=n_trees,
+                             random_state=params['random_state'])
+        return estimator, 'warm_start'
+
+    return estimator.fit(x, y), 'refit'
+
+
+class IncrementalTrainer:
+    """Keeps a voting ensemble and its feature pipeline (main.FeaturePipeline)
+    current as labelled passengers arrive. update engineers and imputes only
+    the new rows with the existing pipeline and updates every member (see
+    update_estimator); it falls back to a full fit when the share of unseen
+    values of the closed categorical vocabularies exceeds [growth_threshold],
+    the open ones (Family, Ticket; see FeaturePipeline.pending_growth) have
+    grown by more than [vocabulary_threshold] since the last full fit, or the
+    new rows' features drift more than [drift_threshold] (mean_shift) from the
+    training set. Boosted members are refitted once they reach [boosting_cap]
+    times their configured number of rounds.
+    """
+
+    def __init__(self, pipeline, models, names, voting='hard', weights=None, growth_threshold=0.05,
+                 vocabulary_threshold=0.2, drift_threshold=0.25, tree_fraction=0.1, boosting_rounds=20,
+                 boosting_cap=2, random_state=0, dtype=np.float32, verbose=1):
+        self.pipeline = pipeline
+        self.models = models
+        self.names = names
+        self.voting = voting
+        self.weights = weights
+        self.growth_threshold = growth_threshold
+        self.vocabulary_threshold = vocabulary_threshold
+        self.drift_threshold = drift_threshold
+        self.tree_fraction = tree_fraction
+        self.boosting_rounds = boosting_rounds
+        self.boosting_cap = boosting_cap
+        # Advanced by every update, and saved with the trainer
+        self.random_state = np.random.RandomState(random_state)
+        self.dtype = dtype
+        self.verbose = verbose
+
+        self.passengers = None
+        self.estimators = []
+        self.train_x = None
+        self.train_y = None
+        self.feature_mean = None
+        self.feature_std = None
+
+    def fit(self, passengers):
+        """Full fit of the pipeline and every model on labelled [passengers]
+        (data/train.csv layout).
+        """
+        self.passengers = passengers.reset_index(drop=True)
+        self.pipeline.fit(self.passengers)
+        self.train_x = self._model_matrix(self.passengers)
+        self.train_y = np.asarray(self.passengers.Survived)
+        self.feature_mean, self.feature_std = column_stats(self.train_x)
+
+        self.estimators = [clone(model).fit(self.train_x, self.train_y) for model in self.models]
+        self.log('Fitted {0} models on {1} passengers'.format(len(self.models), len(self.passengers)), 1)
+
+        return self
+
+    def update(self, passengers):
+        """Add labelled [passengers], updating the fitted models when possible.
+        Returns 'incremental' or 'full'.
+        """
+        growth = self.pipeline.update(passengers)
+        x_new = self._model_matrix(passengers)
+        y_new = np.asarray(passengers.Survived)
+        vocabulary_growth = self.pipeline.pending_growth()
+        drift = mean_shift(x_new, self.feature_mean, self.feature_std)
+        self.log('Update of {0} passengers: {1:.1%} unseen categorical values, {2:.1%} vocabulary growth, '
+                 'drift {3:.3f}'.format(len(passengers), growth, vocabulary_growth, drift), 1)
+
+        if (growth > self.growth_threshold or vocabulary_growth > self.vocabulary_threshold or
+                drift > self.drift_threshold):
+            self.log('Thresholds exceeded, refitting everything', 1)
+            self.fit(pd.concat([self.passengers, passengers], ignore_index=True))
+            return 'full'
+
+        self.passengers = pd.concat([self.passengers, passengers], ignore_index=True)
+        stack = sparse.vstack if sparse.issparse(self.train_x) else np.vstack
+        self.train_x = stack([self.train_x, x_new])
+        if sparse.issparse(self.train_x):
+            self.train_x = self.train_x.tocsr()
+        self.train_y = np.concatenate([self.train_y, y_new])
+
+        for name, model, estimator in zip(self.names, self.models, self.estimators):
+            _, method = update_estimator(estimator, x_new, y_new, self.train_x, self.train_y,
+                                         tree_fraction=self.tree_fraction, boosting_rounds=self.boosting_rounds,
+                                         base_rounds=model.get_params().get('n_estimators'),
+                                         boosting_cap=self.boosting_cap, random_state=self.random_state)
+            self.log('{0}: {1}'.format(name, method), 2)
+
+        return 'incremental'
+
+    def _model_matrix(self, passengers):
+        features = self.pipeline.transform(passengers).drop(['Train', 'Survived'], axis=1, errors='ignore')
+        return to_model_matrix(features, self.dtype)
+
+    def predictor(self):
+        return SurvivalPredictor(self.pipeline, self.estimators, voting=self.voting, weights=self.weights,
+                                 dtype=self.dtype, verbose=self.verbose)
+
+    def save(self, file_name):
+        joblib.dump(self, file_name, compress=3)
+
+        return None
+
+    @staticmethod
+    def load(file_name):
+        return joblib.load(file_name)
+
+    def log(self, msg, verbose):
+        if self.verbose >= verbose:
+            print(msg)
+
+        return None
@@ -0,0 +1,219 @@
+from contextlib import contextmanager
+from functools import wraps
+from scipy import sparse
+
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy as np
+import pandas as pd
+
+
+def shape_counters(x):
+    """Row, column and non-zero counts of a DataFrame, array or sparse matrix.
+    """
+    if sparse.issparse(x):
+        return {'rows': x.shape[0], 'columns': x.shape[1], 'nonzeros': int(x.nnz)}
+    if isinstance(x, pd.DataFrame):
+        x = x.select_dtypes(include=[np.number, bool])
+    x = np.asarray(x)
+    return {'rows': x.shape[0], 'columns': x.shape[1] if x.ndim > 1 else 1,
+            'nonzeros': int(np.count_nonzero(x))}
+
+
+def process_tree_rss(pid=None):
+    """Summed resident set size in bytes of process [pid] (this one by
+    default) and all its descendants, e.g. joblib workers, read from /proc.
+    None where /proc is not available.
+    """
+    if not os.path.isdir('/proc/self'):
+        return None
+
+    pid = os.getpid() if pid is None else pid
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{0}/stat'.format(entry)) as f:
+                # The command name may contain spaces; the parent pid follows it
+                parent = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(parent, []).append(int(entry))
+
+    total, stack = 0, [pid]
+    page_size = os.sysconf('SC_PAGE_SIZE')
+    while stack:
+        current = stack.pop()
+        try:
+            with open('/proc/{0}/statm'.format(current)) as f:
+                total += int(f.read().split()[1]) * page_size
+        except (OSError, IndexError, ValueError):
+            continue
+        stack.extend(children.get(current, []))
+
+    return total
+
+
+def max_rss():
+    """Resident memory high-water marks in bytes of this process and of its
+    waited-for children, from getrusage.
+    """
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    scale = 1 if os.uname().sysname == 'Darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+
+class RssSampler:
+    """Samples process_tree_rss every [interval] seconds on a background
+    thread while active, keeping the peak. This covers native allocations and
+    worker processes, which tracemalloc does not see. Without /proc the peak
+    falls back to the getrusage high-water marks (max_rss) at exit.
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.start_bytes = None
+        self.peak_bytes = None
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.start_bytes = process_tree_rss()
+        self.peak_bytes = self.start_bytes
+        if self.start_bytes is not None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._update()
+        elif resource is not None:
+            self.peak_bytes = sum(max_rss())
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self._update()
+
+    def _update(self):
+        rss = process_tree_rss()
+        if rss is not None:
+            self.peak_bytes = max(self.peak_bytes, rss)
+
+
+class Tracer:
+    """Collects one event per timed stage: wall time, optional peak traced
+    memory (memory=True) or peak resident memory of the process and its
+    workers (rss=True, see RssSampler), and cProfile summary (profile=True),
+    plus any counters attached to the event. Stages can be nested; the trace is
+    written as JSON or CSV by save.
+    """
+
+    def __init__(self, memory=False, rss=False, profile=False, profile_lines=20, verbose=0):
+        self.memory = memory
+        self.rss = rss
+        self.profile = profile
+        self.profile_lines = profile_lines
+        self.verbose = verbose
+        self.events = []
+
+        self._depth = 0
+        self._profiling = False
+
+    @contextmanager
+    def stage(self, name, **fields):
+        """Time the body of a with block. The yielded event dict can be updated
+        with counters (see shape_counters) or results from inside the block.
+        """
+        event = {'stage': name, 'depth': self._depth}
+        event.update(fields)
+
+        owns_memory = self.memory and not tracemalloc.is_tracing()
+        if owns_memory:
+            tracemalloc.start()
+
+        sampler = None
+        if self.rss:
+            sampler = RssSampler().__enter__()
+
+        profiler = None
+        if self.profile and not self._profiling:
+            profiler = cProfile.Profile()
+            self._profiling = True
+            profiler.enable()
+
+        self._depth += 1
+        start = time.time()
+        try:
+            yield event
+        finally:
+            event['seconds'] = time.time() - start
+            self._depth -= 1
+
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                stream = io.StringIO()
+                pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(self.profile_lines)
+                event['profile'] = stream.getvalue()
+
+            if owns_memory:
+                event['peak_mb'] = tracemalloc.get_traced_memory()[1] / 1024.0 ** 2
+                tracemalloc.stop()
+            if sampler is not None:
+                sampler.__exit__(None, None, None)
+                event['peak_rss_mb'] = sampler.peak_bytes / 1024.0 ** 2
+                if sampler.start_bytes is not None:
+                    event['rss_increase_mb'] = (sampler.peak_bytes - sampler.start_bytes) / 1024.0 ** 2
+
+            self.events.append(event)
+            self.log('{0}{1}: {2:.3f}s{3}'.format(
+                '  ' * event['depth'], name, event['seconds'],
+                ''.join(', {0} {1:.1f} MB'.format(label, event[key])
+                        for key, label in [('peak_mb', 'peak'), ('peak_rss_mb', 'peak RSS')] if key in event)), 1)
+
+    def timed(self, name=None):
+        """Decorator form of stage.
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or function.__name__):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def save(self, file_name):
+        """Write the trace as CSV if [file_name] ends in .csv, JSON otherwise.
+        """
+        if file_name.endswith('.csv'):
+            pd.DataFrame(self.events).to_csv(file_name, index=False)
+        else:
+            with open(file_name, 'w') as f:
+                json.dump(self.events, f, indent=2, default=str)
+
+        return None
+
+    def log(self, msg, verbose):
+        if self.verbose >= verbose:
+            print(msg)
+
+        return None
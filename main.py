@@ -1,50 +1,104 @@
-import fancyimpute.mice as fancyimpute
-import numpy as np
-import pandas as pd
+import argparse
 import os
 
-from sklearn.cross_validation import train_test_split, cross_val_score
-from sklearn.ensemble import RandomForestClassifier, AdaBoostClassifier, VotingClassifier, GradientBoostingClassifier
-from sklearn.grid_search import GridSearchCV
-from sklearn.linear_model import LogisticRegression
-from sklearn.svm import SVC
-from sklearn.neural_network import MLPClassifier
-from sklearn.preprocessing.imputation import Imputer
+import numpy as np
+import pandas as pd
 
 from titanic_classifier import SurvivalClassifier
+from ensemble import FittedEnsemble
+from combiners import write_submission
+from prediction_service import SurvivalPredictor
+from incremental import IncrementalTrainer
+from instrumentation import Tracer, shape_counters
+from model_search import SEARCH_STRATEGIES
 
-import xgboost as xgb
+import feature_store
+import registry
 
 
-def ingest_data():
-    """Read in, combine the training and test data.
+def ingest_data(train_file_name='data/train.csv', test_file_name='data/test.csv'):
+    """Read in, combine the training and test data, indexed by PassengerId so
+    that the ids reach the submission without reading the files again.
     """
-    train = pd.read_csv('data/train.csv').assign(Train=1)
-    test = (pd.read_csv('data/test.csv').assign(Train=0)
+    train = pd.read_csv(train_file_name).assign(Train=1)
+    test = (pd.read_csv(test_file_name).assign(Train=0)
             .assign(Survived=-999)[list(train)])
-    return pd.concat([train, test])
+    data = pd.concat([train, test])
+    return data.set_index(data.PassengerId.values)
 
 
-extract_lastname = lambda x: x.split(',')[0]
+# Last name is everything before the first comma, the title runs from there to
+# the next period (e.g. "Braund, Mr. Owen Harris").
+NAME_PATTERN = r'^(?P<LastName>[^,]*),(?P<Title>[^,.]*)'
 
+# Combine reduntant or less common titles together.
+TITLE_GROUPS = dict(
+    [(title, 'Miss') for title in ['Mlle', 'Ms']] +
+    [(title, 'Mrs') for title in ['Mme']] +
+    [(title, 'Esteemed') for title in ['Rev', 'Dr', 'Major', 'Col', 'Capt', 'Jonkheer', 'Dona']] +
+    [(title, 'Royalty') for title in ['Don', 'Lady', 'Sir', 'the Countess']])
 
-def extract_title(x):
-    """Get the person's title from their name. Combine reduntant or less common
-    titles together.
-    """
-    title = x.split(',')[1].split('.')[0][1:]
-    if title in ['Mlle', 'Ms']:
-        title = 'Miss'
-    elif title == 'Mme':
-        title = 'Mrs'
-    elif title in ['Rev', 'Dr', 'Major', 'Col', 'Capt', 'Jonkheer', 'Dona']:
-        title = 'Esteemed'
-    elif title in ['Don', 'Lady', 'Sir', 'the Countess']:
-        title = 'Royalty'
-    return title
 
-
-first_letter = np.vectorize(lambda x: x[:1])
+def parse_names(data):
+    """Get each person's last name and (grouped) title from their name in a
+    single vectorized pass.
+    """
+    names = data.Name.str.extract(NAME_PATTERN)
+    titles = names.Title.str[1:]
+    return data.assign(LastName=names.LastName,
+                       Title=titles.replace(TITLE_GROUPS))
+
+
+# High-cardinality features that the sparse encoding mode keeps out of the
+# dense dummy columns.
+SPARSE_DUMMY_COLUMNS = ['Family', 'Ticket']
+
+# Features whose vocabularies FeaturePipeline learns at fit time.
+CATEGORICAL_FEATURES = ['Pclass', 'Family', 'Title', 'Ticket', 'Deck', 'Embarked']
+
+# Open-ended vocabularies: nearly every new passenger brings a new family, and
+# shared tickets keep appearing. Their unseen values encode as all zeros, like
+# a passenger travelling alone, until the next full fit adds them as columns.
+OPEN_FEATURES = ['Family', 'Ticket']
+
+# Bump whenever feature_engineering or impute change their output, so that
+# stale entries in the feature store are rebuilt.
+FEATURE_PIPELINE_VERSION = 3
+FEATURE_CACHE_DIR = 'temp/features'
+INPUT_FILES = ['data/train.csv', 'data/test.csv']
+
+# Features that may hold imputed, fractional values. The compact dtype policy
+# always stores them as float32.
+IMPUTED_FEATURES = ['Age', 'Fare', 'Deck_', 'Embarked_']
+
+# Compact dtypes for chunked reading of passenger files.
+PASSENGER_DTYPES = {
+    'PassengerId': np.int32,
+    'Survived': np.int16,
+    'Name': str,
+    'Ticket': str,
+    'Cabin': str,
+    'Pclass': 'category',
+    'Sex': 'category',
+    'Age': np.float32,
+    'SibSp': np.int16,
+    'Parch': np.int16,
+    'Fare': np.float32,
+    'Embarked': 'category'
+}
+
+
+# Free-text passenger columns. read_csv infers a float column for a batch
+# without any Cabin and an integer one for purely numeric Tickets, so they are
+# always read, and parsed, as strings.
+TEXT_COLUMNS = ['Name', 'Ticket', 'Cabin']
+
+
+def text_columns(data):
+    """[data] with the TEXT_COLUMNS it has as strings, missing values kept.
+    """
+    return data.assign(**dict((col, data[col].astype(str).where(data[col].notna()))
+                              for col in TEXT_COLUMNS if col in data))
 
 
 def ticket_counts(data):
@@ -76,48 +130,105 @@ def create_dummy_nans(data, col_name):
     return data.drop([col_name + 'nan'], axis=1)
 
 
-def impute(data):
+def impute(data, method='mice'):
     """Impute missing values in the Age, Deck, Embarked, and Fare features.
+    Sparse categorical columns are passed through untouched; a missing category
+    simply encodes as an all-zero row.
+
+    method is 'mice' (fancyimpute), 'chained' (imputation.ColumnImputer, which
+    only models the incomplete columns) or 'mean' (single pass).
     """
 
     impute_missing = data.drop(['Survived', 'Train'], axis=1)
     impute_missing_cols = list(impute_missing)
+    sparse_cols = [col for col in impute_missing_cols
+                   if isinstance(impute_missing[col].dtype, pd.CategoricalDtype)]
+    impute_missing = impute_missing.drop(sparse_cols, axis=1)
 
-    filled_soft = fancyimpute.MICE().complete(np.array(impute_missing))
-    # filled_soft = Imputer().fit_transform(impute_missing)
+    if method == 'mice':
+        filled_soft = registry.create('imputer', 'mice').complete(np.array(impute_missing))
+    else:
+        filled_soft = registry.create('imputer', 'chained', method=method, columns=list(impute_missing),
+                                      verbose=1).fit_transform(impute_missing)
 
-    results = pd.DataFrame(filled_soft, columns=impute_missing_cols)
+    results = pd.DataFrame(filled_soft, columns=list(impute_missing), index=data.index)
+    assert results.isnull().sum().sum() == 0, 'Not all NAs removed'
+    for col in sparse_cols:
+        results[col] = data[col].values
+    results = results[impute_missing_cols]
     results['Train'] = list(data['Train'])
     results['Survived'] = list(data['Survived'])
-    assert results.isnull().sum().sum() == 0, 'Not all NAs removed'
 
     return results
 
 
-def feature_engineering(data):
-    data = (data
+def compact_dtype(col, values):
+    """uint8 for 0/1 indicators, the smallest integer type for other integral
+    features and float32 for continuous (and imputed) ones.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return values.dtype
+    if any(col.startswith(prefix) for prefix in IMPUTED_FEATURES):
+        return np.dtype(np.float32)
+    if values.dtype == bool or values.isin([0, 1]).all():
+        return np.dtype(np.uint8)
+    if (values % 1 == 0).all():
+        return pd.to_numeric(values, downcast='integer').dtype
+    return np.dtype(np.float32)
+
+
+def compact_dtypes(data, verbose=1):
+    """Apply the compact dtype policy to every column and report the memory
+    saved.
+    """
+    before = data.memory_usage(deep=True).sum()
+    data = data.astype(dict((col, compact_dtype(col, data[col])) for col in data))
+    after = data.memory_usage(deep=True).sum()
+
+    if verbose:
+        print('Feature matrix memory: {0:.1f} MB -> {1:.1f} MB ({2:.1f}x smaller)'.format(
+            before / 1024.0 ** 2, after / 1024.0 ** 2, before / float(max(after, 1))))
+
+    return data
+
+
+def sparse_dummies(data, columns):
+    """Keep high-cardinality categorical columns as pandas categoricals. The
+    categories are shared by every row of the combined frame, so the one-hot
+    encoding can be expanded into a CSR block at model fitting time (see
+    titanic_classifier.to_model_matrix) instead of as dense dummy columns.
+    """
+    for col in columns:
+        data[col] = data[col].astype('category')
+    return data
+
+
+def parse_passengers(data):
+    """Row-wise features that need no knowledge of the other passengers.
+    """
+    return (data
             # Create last name, title, family size, and family features
-            .assign(LastName=lambda x: x.Name.map(extract_lastname))
-            .assign(Title=lambda x: x.Name.map(extract_title))
+            .pipe(parse_names)
             .assign(FamSize=lambda x: x.SibSp + x.Parch + 1)
-            .assign(Family=lambda x: [a + '_' + str(b) for a, b in zip(
-        list(x.LastName), list(x.FamSize))])
+            .assign(Family=lambda x: x.LastName + '_' + x.FamSize.astype(str))
             # Turn the Cabin feature into a Deck feature (A-G)
-            .assign(Deck=lambda x: np.where(
-        pd.notnull(x.Cabin), first_letter(x.Cabin.fillna('z')), x.Cabin))
-            .assign(Deck=lambda x: np.where(x.Deck == 'T', np.nan, x.Deck))
+            .assign(Deck=lambda x: x.Cabin.str[:1])
+            .assign(Deck=lambda x: x.Deck.where(x.Deck != 'T'))
 
             # Turn Sex into a dummy variable
             .assign(Sex=lambda x: np.where(x.Sex == 'male', 1, 0)))
 
-    return (data
 
-            # Create ticket counts for passengers sharing tickets
-            .pipe(ticket_counts)
+def encode_dummies(data, sparse_cols):
+    """Create dummy variables for the categorical features, keeping
+    [sparse_cols] as categoricals and the NaNs of Deck and Embarked in place.
+    """
+    dummy_cols = [col for col in ['Pclass', 'Family', 'Title', 'Ticket']
+                  if col not in sparse_cols]
 
-            # Create dummy variables for the categorical features
-            .assign(Pclass=lambda x: x.Pclass.astype(str))
-            .pipe(pd.get_dummies, columns=['Pclass', 'Family', 'Title', 'Ticket'])
+    return (data
+            .pipe(sparse_dummies, sparse_cols)
+            .pipe(pd.get_dummies, columns=dummy_cols)
             .pipe(pd.get_dummies, columns=['Deck'], dummy_na=True)
             .pipe(pd.get_dummies, columns=['Embarked'], dummy_na=True)
             .pipe(create_dummy_nans, 'Deck_')
@@ -125,24 +236,235 @@ def feature_engineering(data):
 
             # Drop columns we don't need
             .drop(['Name', 'Cabin', 'PassengerId', 'SibSp', 'Parch', 'LastName'],
-                  axis=1)
+                  axis=1))
+
+
+def encode_features(data, sparse=False):
+    """Parse and one-hot encode the passengers; missing values are left for
+    impute.
+    """
+    sparse_cols = SPARSE_DUMMY_COLUMNS if sparse else []
+
+    return (data
+            .pipe(parse_passengers)
+
+            # Create ticket counts for passengers sharing tickets
+            .pipe(ticket_counts)
+
+            .assign(Pclass=lambda x: x.Pclass.astype(str))
+            .pipe(encode_dummies, sparse_cols)
+            )
+
+
+def feature_engineering(data, sparse=False, impute_method='mice'):
+    return (data
+            .pipe(encode_features, sparse=sparse)
+
+            # Impute NAs, using MICE by default
+            .pipe(impute, method=impute_method)
 
-            # Impute NAs using MICE
-            .pipe(impute)
+            .pipe(compact_dtypes)
             )
 
 
+class FeaturePipeline:
+    """Stateful counterpart of feature_engineering. fit learns the category
+    vocabularies, the shared tickets and the imputation model from a reference
+    set of passengers; transform then engineers any batch of new passengers on
+    its own, in time proportional to the batch size.
+
+    MICE has no separate transform step, so the imputation model is any
+    fit/transform imputer (imputation.ColumnImputer by default).
+
+    update adds new passengers to the ticket counts without refitting; values
+    missing from the vocabularies are collected in new_values and only become
+    columns at the next fit, so the model matrix keeps its width in between.
+    pending_growth measures how much the open vocabularies (OPEN_FEATURES)
+    have grown since.
+    """
+
+    def __init__(self, sparse=False, imputer=None):
+        self.sparse = sparse
+        self.imputer = registry.create('imputer', 'chained') if imputer is None else imputer
+        self.ticket_count = pd.Series(dtype=np.int64)
+        self.shared_tickets = set()
+        self.vocabularies = {}
+        self.new_values = {}
+        self.feature_columns = []
+        self.dense_columns = []
+        self.feature_dtypes = {}
+
+    def fit(self, data):
+        data = text_columns(data)
+        self.ticket_count = data.Ticket.value_counts()
+        self.shared_tickets = set(self.ticket_count.index[self.ticket_count > 1])
+
+        parsed = self._parse(data)
+        self.vocabularies = {col: sorted(parsed[col].dropna().unique())
+                             for col in CATEGORICAL_FEATURES}
+        self.new_values = dict((col, set()) for col in CATEGORICAL_FEATURES)
+
+        self._fit_imputer(parsed)
+
+        return self
+
+    def fit_chunks(self, chunks, sample_size=50000, random_state=0):
+        """Out-of-core fit over an iterable of passenger chunks (see
+        read_passengers) in a single pass. Ticket counts and vocabularies are
+        accumulated chunk by chunk, and the imputer is fitted on a uniform sample
+        of at most [sample_size] passengers, so memory stays bounded by the chunk
+        size, the sample size and the vocabularies.
+        """
+        rng = np.random.RandomState(random_state)
+        ticket_count = pd.Series(dtype=np.int64)
+        vocabularies = dict((col, set()) for col in CATEGORICAL_FEATURES if col != 'Ticket')
+        sample = None
+
+        for chunk in chunks:
+            ticket_count = ticket_count.add(chunk.Ticket.value_counts(), fill_value=0)
+
+            parsed = (chunk
+                      .drop([col for col in ['Train', 'Survived'] if col in chunk], axis=1)
+                      .pipe(parse_passengers)
+                      .assign(Pclass=lambda x: x.Pclass.astype(str)))
+            for col, values in vocabularies.items():
+                values.update(parsed[col].dropna().unique())
+
+            # Keeping the rows with the smallest random keys gives a uniform sample
+            chunk = chunk.assign(SampleKey=rng.rand(len(chunk)))
+            sample = chunk if sample is None else pd.concat([sample, chunk])
+            sample = sample.nsmallest(sample_size, 'SampleKey')
+
+        self.ticket_count = ticket_count
+        self.shared_tickets = set(ticket_count.index[ticket_count > 1])
+        self.vocabularies = dict((col, sorted(values)) for col, values in vocabularies.items())
+        self.vocabularies['Ticket'] = sorted(self.shared_tickets)
+        self.new_values = dict((col, set()) for col in CATEGORICAL_FEATURES)
+
+        self._fit_imputer(self._parse(sample.drop(['SampleKey'], axis=1)))
+
+        return self
+
+    def update(self, data):
+        """Count the tickets of new passengers and collect their categorical
+        values that the vocabularies do not know yet. Returns the fraction of
+        the batch's values of the closed vocabularies (all but OPEN_FEATURES)
+        that were unseen.
+        """
+        data = text_columns(data)
+        self.ticket_count = self.ticket_count.add(data.Ticket.value_counts(), fill_value=0)
+        self.shared_tickets = set(self.ticket_count.index[self.ticket_count > 1])
+
+        parsed = self._parse(data)
+        unseen, total = 0, 0
+        for col in CATEGORICAL_FEATURES:
+            values = parsed[col].dropna()
+            new = values[~values.isin(self.vocabularies[col])]
+            self.new_values[col].update(new.unique())
+            if col not in OPEN_FEATURES:
+                unseen += len(new)
+                total += len(values)
+
+        return unseen / float(max(total, 1))
+
+    def pending_growth(self):
+        """Largest relative growth of an open vocabulary since the last fit.
+        """
+        return max(len(self.new_values[col]) / float(max(len(self.vocabularies[col]), 1))
+                   for col in OPEN_FEATURES)
+
+    def transform_chunks(self, chunks):
+        """Engineer an iterable of passenger chunks one at a time.
+        """
+        for chunk in chunks:
+            yield self.transform(chunk)
+
+    def transform(self, data):
+        features = self._encode(self._parse(data))[self.feature_columns]
+
+        filled = self.imputer.transform(np.array(features[self.dense_columns], dtype=np.float64))
+        results = pd.DataFrame(filled, columns=self.dense_columns, index=data.index)
+        for col in self.feature_columns:
+            if col not in self.dense_columns:
+                results[col] = features[col].values
+        results = results[self.feature_columns].astype(self.feature_dtypes)
+
+        # Keep the bookkeeping columns so that split_data works on the output
+        for col in ['Train', 'Survived']:
+            if col in data:
+                results[col] = list(data[col])
+
+        return results
+
+    def fit_transform(self, data):
+        return self.fit(data).transform(data)
+
+    def _fit_imputer(self, parsed):
+        features = self._encode(parsed)
+        self.feature_columns = list(features)
+        self.dense_columns = [col for col in self.feature_columns
+                              if not isinstance(features[col].dtype, pd.CategoricalDtype)]
+        self.feature_dtypes = dict((col, compact_dtype(col, features[col])) for col in self.dense_columns)
+        self.imputer.fit(np.array(features[self.dense_columns], dtype=np.float64))
+
+        return None
+
+    def _parse(self, data):
+        return (data
+                .pipe(text_columns)
+                .drop([col for col in ['Train', 'Survived'] if col in data], axis=1)
+                .pipe(parse_passengers)
+                .assign(Ticket=lambda x: x.Ticket.where(x.Ticket.isin(self.shared_tickets)))
+                .assign(Pclass=lambda x: x.Pclass.astype(str)))
+
+    def _encode(self, parsed):
+        # Fixing the categories up front makes get_dummies emit the same columns
+        # for every batch; unseen values encode as all zeros.
+        for col, categories in self.vocabularies.items():
+            parsed[col] = pd.Categorical(parsed[col], categories=categories)
+
+        sparse_cols = SPARSE_DUMMY_COLUMNS if self.sparse else []
+        return encode_dummies(parsed, sparse_cols)
+
+
+def read_passengers(file_names=INPUT_FILES, chunk_size=100000):
+    """Read passenger files chunk by chunk with compact dtypes. Files that have a
+    Survived column are training data, as in ingest_data.
+    """
+    for file_name in file_names:
+        train = 'Survived' in pd.read_csv(file_name, nrows=0)
+        for chunk in pd.read_csv(file_name, dtype=PASSENGER_DTYPES, chunksize=chunk_size):
+            if train:
+                yield chunk.assign(Train=1)
+            else:
+                yield chunk.assign(Train=0).assign(Survived=-999)
+
+
+def stream_features(file_names=INPUT_FILES, chunk_size=100000, sparse=True, pipeline=None):
+    """Two-pass out-of-core feature engineering. The first pass fits the
+    pipeline (global ticket counts, vocabularies, imputer sample); the second is
+    returned as a generator of engineered chunks. The Family and Ticket
+    vocabularies grow with the input, so chunks use the sparse encoding by
+    default to keep their memory bounded by the chunk size.
+    """
+    pipeline = FeaturePipeline(sparse=sparse) if pipeline is None else pipeline
+    pipeline.fit_chunks(read_passengers(file_names, chunk_size))
+
+    return pipeline, pipeline.transform_chunks(read_passengers(file_names, chunk_size))
+
+
 def split_data(data):
     """
     Split the combined training/prediction data into separate training and
     prediction sets.
     """
 
-    outcomes = np.array(data.query('Train == 1')['Survived'])
-    train = (data.query('Train == 1')
-             .drop(['Train', 'Survived'], axis=1))
-    to_predict = (data.query('Train == 0')
-                  .drop(['Train', 'Survived'], axis=1))
+    train_mask = np.asarray(data['Train'] == 1)
+    features = data.drop(['Train', 'Survived'], axis=1)
+
+    outcomes = np.asarray(data['Survived'])[train_mask]
+    train = features[train_mask]
+    to_predict = features[~train_mask]
 
     return train, outcomes, to_predict
 
@@ -155,6 +477,9 @@ def train_test_model(model, model_name, hyperparameters, X_train, X_test, y_trai
     optimized hyperparameters, and prints out model evaluation metrics.
     """
 
+    from sklearn.cross_validation import cross_val_score
+    from sklearn.grid_search import GridSearchCV
+
     print('Optimizing {0}'.format(model_name))
 
     optimized_model = GridSearchCV(model, hyperparameters, cv=folds,
@@ -174,40 +499,31 @@ def train_test_model(model, model_name, hyperparameters, X_train, X_test, y_trai
     return optimized_model
 
 
-def majority_vote_ensemble(name, models_votes, train, outcomes, to_predict):
+def majority_vote_ensemble(name, models_votes, train, outcomes, to_predict, ensemble=None):
     """Creates a submission from a majority voting ensemble, given training/
-    testing data and a list of models and votes.
+    testing data and a list of models and votes. Returns the FittedEnsemble, so
+    that other votes can be tried without refitting the models.
     """
 
-    model_results = []
-    for model, votes in models_votes:
-        model.fit(np.array(train), outcomes)
-        probs = model.predict(np.array(to_predict))
-        probs[probs == 0] = -1
-        model_results.append((probs, votes))
+    models = [model for model, votes in models_votes]
+    ensemble = (ensemble or FittedEnsemble()).fit(
+        models, [type(model).__name__ for model in models], np.array(train), outcomes, np.array(to_predict))
 
-    ensemble = pd.read_csv('data/test.csv')[['PassengerId']].assign(
-        Survived=0)
+    write_submission(name, to_predict.index, ensemble.predict(weights=[votes for model, votes in models_votes]))
 
-    for probs, votes in model_results:
-        for i in range(0, votes):
-            ensemble = ensemble.assign(Survived=lambda x: x.Survived + probs)
+    return ensemble
 
-    (ensemble.assign(Survived=lambda x: np.where(x.Survived > 0, 1, 0))
-     .to_csv(name, index=False))
 
-    return None
-
-
-def vote_classifier(output_file_name, models, train, y, test, weights=None):
-    voting_classifier = VotingClassifier(estimators=models, voting='hard')
-    voting_classifier = voting_classifier.fit(train, y)
+def vote_classifier(output_file_name, models, train, y, test, weights=None, ensemble=None):
+    """Hard voting submission from (name, model) pairs. Returns the
+    FittedEnsemble for reuse with other weights.
+    """
+    ensemble = (ensemble or FittedEnsemble()).fit(
+        [model for name, model in models], [name for name, model in models], train, y, test)
 
-    ensemble = pd.read_csv('data/test.csv')[['PassengerId']].assign(
-        Survived=voting_classifier.predict(test))
+    write_submission(output_file_name, test.index, ensemble.predict(voting='hard', weights=weights))
 
-    ensemble.to_csv(output_file_name, index=False)
-    return None
+    return ensemble
 
 
 def model_and_submit(train, outcomes, to_predict, output_file_name, find_hyperparameters):
@@ -217,6 +533,8 @@ def model_and_submit(train, outcomes, to_predict, output_file_name, find_hyperpa
     """
 
     if find_hyperparameters:
+        from sklearn.cross_validation import train_test_split
+
         X_train, X_test, y_train, y_test = train_test_split(
             train, outcomes, test_size=0.2, random_state=50)
 
@@ -231,7 +549,7 @@ def model_and_submit(train, outcomes, to_predict, output_file_name, find_hyperpa
         #     y_test).best_estimator_
 
         rf_model = train_test_model(
-            RandomForestClassifier(n_estimators=800, random_state=25),
+            registry.create('model', 'random_forest', n_estimators=800, random_state=25),
             'RandomForestClassifier', {
                 'min_samples_split': [1, 3, 10],
                 'min_samples_leaf': [1, 3, 10],
@@ -239,32 +557,32 @@ def model_and_submit(train, outcomes, to_predict, output_file_name, find_hyperpa
             X_train, X_test, y_train, y_test).best_estimator_
 
         lr_model = train_test_model(
-            LogisticRegression(random_state=25),
+            registry.create('model', 'logistic_regression', random_state=25),
             'LogisticRegression', {
                 'C': [0.001, 0.01, 0.1, 1, 10, 100, 1000],
                 'class_weight': [None, 'balanced']},
             X_train, X_test, y_train, y_test).best_estimator_
 
         svm_model = train_test_model(
-            SVC(probability=True, random_state=25),
+            registry.create('model', 'svc', probability=True, random_state=25),
             'SVC', {
                 'C': [0.001, 0.01, 0.1, 1, 10, 100, 1000],
                 'gamma': np.logspace(-9, 3, 13)},
             X_train, X_test, y_train, y_test).best_estimator_
 
     else:
-        rf_model = RandomForestClassifier(n_estimators=800, random_state=25,
-                                          min_samples_split=3, max_depth=None, min_samples_leaf=1)
+        rf_model = registry.create('model', 'random_forest', n_estimators=800, random_state=25,
+                                   min_samples_split=3, max_depth=None, min_samples_leaf=1)
 
         # gbt_model = xgb.XGBClassifier(learning_rate=0.05, n_estimators=200,
         #                               seed=25, reg_alpha=0.01, max_depth=3, gamma=0.1,
         #                               min_child_weight=1)
 
-        lr_model = LogisticRegression(random_state=25, C=10,
-                                      class_weight='balanced')
+        lr_model = registry.create('model', 'logistic_regression', random_state=25, C=10,
+                                   class_weight='balanced')
 
-        svm_model = SVC(probability=True, random_state=25, C=1000,
-                        gamma=0.0001)
+        svm_model = registry.create('model', 'svc', probability=True, random_state=25, C=1000,
+                                    gamma=0.0001)
 
     # models_votes = [(rf_model, 2), (lr_model, 1), (svm_model, 1)]
     # majority_vote_ensemble(output_file_name, models_votes, train, outcomes, to_predict)
@@ -275,57 +593,61 @@ def model_and_submit(train, outcomes, to_predict, output_file_name, find_hyperpa
 
 
 def main():
-    data = ingest_data()
-    data = feature_engineering(data)
-
-    print(data)
-    train, outcomes, to_predict = split_data(data)
+    train, outcomes, to_predict = pre_process_data()
     model_and_submit(train, outcomes, to_predict, output_file_name='Output_titanic',
                      find_hyperparameters=False)
 
 
-def pre_process_data(train_x_file_name, train_y_file_name, test_x_file_name):
-    data = ingest_data()
-    data = feature_engineering(data)
-
-    print(data)
-
-    train_x, train_y, test_x = split_data(data)
+def pre_process_data(sparse=False, impute_method='mice', tracer=None, file_names=INPUT_FILES):
+    tracer = Tracer(verbose=1) if tracer is None else tracer
 
-    train_x.to_csv(train_x_file_name, index=False)
-    pd.DataFrame(train_y).to_csv(train_y_file_name, index=False)
-    test_x.to_csv(test_x_file_name, index=False)
+    with tracer.stage('ingest_data') as event:
+        data = ingest_data(*file_names)
+        event.update(shape_counters(data))
+    with tracer.stage('feature_engineering', sparse=sparse) as event:
+        data = encode_features(data, sparse=sparse)
+        event.update(shape_counters(data))
+    with tracer.stage('impute', method=impute_method) as event:
+        data = compact_dtypes(impute(data, method=impute_method))
+        event.update(shape_counters(data))
+    with tracer.stage('split_data'):
+        return split_data(data)
 
 
-def custom_classifier():
-    temp_train_x = 'temp/train_x'
-    temp_train_y = 'temp/train_y'
-    temp_test_x = 'temp/test_x'
+def cached_features(sparse=False, impute_method='mice', cache_dir=FEATURE_CACHE_DIR):
+    """Load the engineered training/prediction sets from the feature store,
+    rebuilding them whenever the input files, FEATURE_PIPELINE_VERSION, the
+    encoding mode or the imputation method change.
+    """
+    key = feature_store.cache_key(INPUT_FILES, FEATURE_PIPELINE_VERSION, sparse=sparse,
+                                  impute_method=impute_method)
 
-    if not (os.path.isfile(temp_train_x) & os.path.isfile(temp_train_y) & os.path.isfile(temp_test_x)):
-        pre_process_data(temp_train_x, temp_train_y, temp_test_x)
+    features = feature_store.load_features(cache_dir, key)
+    if features is None:
+        feature_store.save_features(cache_dir, key, *pre_process_data(sparse=sparse, impute_method=impute_method))
+        features = feature_store.load_features(cache_dir, key)
 
-    train_x = pd.read_csv(temp_train_x)
-    train_y = pd.read_csv(temp_train_y).T.values[0]
-    test_x = pd.read_csv(temp_test_x)
+    return features
 
-    titanic_classifier = SurvivalClassifier(train_x, train_y, test_x, verbose=3)
 
-    titanic_classifier.append_model(
-        LogisticRegression(random_state=33, n_jobs=1, C=1000, class_weight=None, max_iter=100, solver='liblinear'),
-        'Logistic Regression',
+# Model configurations: key -> (display name, registry.BACKENDS['model'] name,
+# parameters, hyper parameter grid). Estimators are only imported and built
+# for the keys a run selects.
+MODEL_CONFIGS = {
+    'lr': (
+        'Logistic Regression', 'logistic_regression',
+        dict(random_state=33, n_jobs=1, C=1000, class_weight=None, max_iter=100, solver='liblinear'),
         {
             'C': [0.001, 0.01, 0.1, 1, 10, 100, 1000, 1200],
             'class_weight': [None, 'balanced'],
             'solver': ['newton-cg', 'lbfgs', 'liblinear', 'sag'],
             'max_iter': [50, 100, 300, 400, 500]
         }
-    )
-
-    titanic_classifier.append_model(
-        RandomForestClassifier(random_state=75, n_jobs=-1, max_depth=None, criterion='gini', min_samples_leaf=1,
-                               min_samples_split=3, n_estimators=800, class_weight=None),
-        'Random Forest Classifier',
+    ),
+    'rf': (
+        'Random Forest Classifier', 'random_forest',
+        dict(random_state=75, n_jobs=-1, max_depth=None, criterion='gini', min_samples_leaf=1,
+             min_samples_split=3, n_estimators=800, class_weight=None),
         {
             'n_estimators': [600, 800, 1200],
             'min_samples_split': [1, 3, 10, 50],
@@ -334,12 +656,11 @@ def custom_classifier():
             'criterion': ['gini', 'entropy'],
             'class_weight': ['balanced', None]
         }
-    )
-
-    titanic_classifier.append_model(
-        RandomForestClassifier(random_state=50, n_jobs=-1, max_depth=None, criterion='entropy', min_samples_leaf=1,
-                               min_samples_split=3, n_estimators=800, class_weight=None),
-        'Random Forest Classifier Entropy',
+    ),
+    'rf_entropy': (
+        'Random Forest Classifier Entropy', 'random_forest',
+        dict(random_state=50, n_jobs=-1, max_depth=None, criterion='entropy', min_samples_leaf=1,
+             min_samples_split=3, n_estimators=800, class_weight=None),
         {
             'n_estimators': [600, 800, 1200],
             'min_samples_split': [1, 3, 10, 50],
@@ -348,13 +669,11 @@ def custom_classifier():
             'criterion': ['gini', 'entropy'],
             'class_weight': ['balanced', None]
         }
-    )
-
-    titanic_classifier.append_model(
-        xgb.XGBClassifier(gamma=0.0, learning_rate=0.01, n_estimators=200,
-                          reg_alpha=0.001, subsample=1, max_depth=6,
-                          min_child_weight=1, seed=25),
-        'Extreme Gradient Boost Classifier',
+    ),
+    'xgb': (
+        'Extreme Gradient Boost Classifier', 'xgboost',
+        dict(gamma=0.0, learning_rate=0.01, n_estimators=200, reg_alpha=0.001, subsample=1, max_depth=6,
+             min_child_weight=1, seed=25),
         {
             'learning_rate': [0.01, 0.05, 0.1, 0.3],
             'max_depth': [3, 6, 10],
@@ -363,42 +682,248 @@ def custom_classifier():
             'reg_alpha': [0.001, 0.01, 0.1, 1],
             'subsample': [0.5, 1]
         }
+    ),
+    'mlp': (
+        'Multi Layer Perceptron', 'mlp',
+        dict(random_state=77, hidden_layer_sizes=500, max_iter=1000, alpha=0.01, activation='tanh', tol=0.01,
+             solver='lbfgs'),
+        {
+            'hidden_layer_sizes': [(100,), (300,), (500,)],
+            'activation': ['relu', 'tanh'],
+            'alpha': [0.0001, 0.003, 0.01],
+            'max_iter': [200, 400, 600],
+            'tol': [0.0001, 0.003, 0.01]
+        }
+    ),
+    'svc': (
+        'SVC', 'svc',
+        dict(probability=True, random_state=12, C=1000, gamma=0.0001, tol=0.0001),
+        {
+            'C': [0.001, 0.01, 0.1, 1, 10, 100, 1000],
+            'gamma': np.logspace(-9, 3, 13),
+            'tol': [0.0001, 0.003, 0.01]
+        }
     )
+}
+
+DEFAULT_MODELS = ['lr', 'rf', 'rf_entropy', 'xgb']
+
+
+def default_models(model_keys=DEFAULT_MODELS):
+    """(model, name, hyper parameter grid) of the MODEL_CONFIGS entries named
+    in [model_keys].
+    """
+    return [(registry.create('model', MODEL_CONFIGS[key][1], **MODEL_CONFIGS[key][2]), MODEL_CONFIGS[key][0],
+             MODEL_CONFIGS[key][3]) for key in model_keys]
+
+
+def append_default_models(titanic_classifier, model_keys=DEFAULT_MODELS):
+    for model, model_name, hyper_parameters in default_models(model_keys):
+        titanic_classifier.append_model(model, model_name, hyper_parameters)
+
+    return titanic_classifier
+
+
+def train_predictor(model_file_name='temp/predictor.pkl', sparse=False, voting='hard', weights=None,
+                    model_keys=DEFAULT_MODELS, compiled=False, impute_method='chained'):
+    """Fit a FeaturePipeline and the default voting ensemble on all labelled
+    passengers, and save them as a SurvivalPredictor (with its tree models
+    compiled to node arrays if [compiled]). [impute_method] is 'chained' or
+    'mean'; MICE cannot impute new passengers on their own.
+    """
+    if impute_method not in ('chained', 'mean'):
+        raise ValueError('A predictor cannot impute with {0}'.format(impute_method))
+
+    pipeline = FeaturePipeline(sparse=sparse, imputer=registry.create('imputer', 'chained', method=impute_method))
+    train_x, train_y, test_x = split_data(pipeline.fit_transform(ingest_data()))
 
-    # titanic_classifier.append_model(
-    #     MLPClassifier(random_state=77, hidden_layer_sizes=500, max_iter=1000,
-    #                   alpha=0.01, activation='tanh',
-    #                   tol=0.01, solver='lbfgs'),
-    #     'Multi Layer Perceptron',
-    #     {
-    #         'hidden_layer_sizes': [(100,), (300,), (500,)],
-    #         'activation': ['relu', 'tanh'],
-    #         'alpha': [0.0001, 0.003, 0.01],
-    #         'max_iter': [200, 400, 600],
-    #         'tol': [0.0001, 0.003, 0.01]
-    #     }
-    # )
-    #
-    # titanic_classifier.append_model(
-    #     SVC(probability=True, random_state=12, C=1000, gamma=0.0001, tol=0.0001),
-    #     'SVC',
-    #     {
-    #         'C': [0.001, 0.01, 0.1, 1, 10, 100, 1000],
-    #         'gamma': np.logspace(-9, 3, 13),
-    #         'tol': [0.0001, 0.003, 0.01]
-    #     }
-    # )
-
-    # titanic_classifier.optimize_models()
-    # titanic_classifier.plot_learning_curves()
-    # titanic_classifier.accuracy_report(folds=3)
-    # titanic_classifier.blend_logistic_regression()
-    titanic_classifier.voting()
-    titanic_classifier.flush_result('voting.csv', 'data/test.csv')
-
-    # titanic_classifier.feature_selection()
-    # titanic_classifier.learn_predict_flush('output.csv', 'data/test.csv', weights=[2, 1, 1])
+    titanic_classifier = append_default_models(SurvivalClassifier(train_x, train_y, test_x, verbose=1), model_keys)
+    titanic_classifier.voting(voting=voting, weights=weights)
+
+    predictor = SurvivalPredictor.from_classifier(pipeline, titanic_classifier, voting=voting, weights=weights,
+                                                  compiled=compiled)
+    predictor.save(model_file_name)
+
+    return predictor
+
+
+def predict_file(input_file_name, output_file_name, model_file_name='temp/predictor.pkl', chunk_size=10000):
+    """Score a passenger CSV with a saved SurvivalPredictor.
+    """
+    SurvivalPredictor.load(model_file_name).predict_csv(input_file_name, output_file_name, chunk_size=chunk_size)
+
+    return None
+
+
+def refresh_predictor(new_file_name, trainer_file_name='temp/trainer.pkl', model_file_name='temp/predictor.pkl',
+                      sparse=False, model_keys=DEFAULT_MODELS):
+    """Add the labelled passengers in [new_file_name] to the saved
+    IncrementalTrainer (fitted on data/train.csv the first time) and save the
+    refreshed SurvivalPredictor.
+    """
+    if os.path.exists(trainer_file_name):
+        trainer = IncrementalTrainer.load(trainer_file_name)
+    else:
+        models = default_models(model_keys)
+        trainer = IncrementalTrainer(FeaturePipeline(sparse=sparse), [model for model, _, _ in models],
+                                     [model_name for _, model_name, _ in models]).fit(pd.read_csv(INPUT_FILES[0]))
+
+    trainer.update(pd.read_csv(new_file_name))
+    trainer.save(trainer_file_name)
+    trainer.predictor().save(model_file_name)
+
+    return trainer
+
+
+def run_preprocess(args):
+    cached_features(sparse=args.sparse, impute_method=args.impute_method)
+
+    return None
+
+
+def worker_executor(args):
+    """SocketExecutor for the --workers host:port addresses, or for
+    --local-workers processes started on this machine; None otherwise.
+    """
+    if args.local_workers:
+        from executors import LocalCluster
+        return LocalCluster(args.local_workers).executor(verbose=args.verbose)
+    if args.workers:
+        from executors import SocketExecutor, read_authkey
+        addresses = [(address.rsplit(':', 1)[0], int(address.rsplit(':', 1)[1])) for address in args.workers]
+        return SocketExecutor(addresses, authkey=read_authkey(file_name=args.authkey_file), verbose=args.verbose)
+
+    return None
+
+
+def load_classifier(args):
+    train_x, train_y, test_x = cached_features(sparse=args.sparse, impute_method=args.impute_method)
+    titanic_classifier = SurvivalClassifier(train_x, train_y, test_x, verbose=args.verbose,
+                                            executor=worker_executor(args))
+
+    return append_default_models(titanic_classifier, args.models)
+
+
+def run_optimize(args):
+    titanic_classifier = load_classifier(args)
+    titanic_classifier.optimize_models(folds=args.folds, search=args.search, report_file_name=args.report,
+                                       trial_store=args.trial_store)
+    if args.learning_curves:
+        titanic_classifier.plot_learning_curves(output_dir=args.learning_curves)
+
+    return None
+
+
+def run_ensemble(args):
+    titanic_classifier = load_classifier(args)
+    if args.feature_selection:
+        titanic_classifier.feature_selection(folds=args.folds)
+
+    if args.method == 'voting':
+        titanic_classifier.voting(voting=args.voting, weights=args.weights)
+    elif args.method == 'blending':
+        titanic_classifier.blending(n_folds=args.folds)
+    else:
+        titanic_classifier.stacking()
+    titanic_classifier.flush_result(args.output)
+
+    if args.save_predictor:
+        train_predictor(args.save_predictor, sparse=args.sparse, voting=args.voting, weights=args.weights,
+                        model_keys=args.models, compiled=args.compile, impute_method=args.impute_method)
+
+    return None
+
+
+def run_refresh(args):
+    refresh_predictor(args.input, trainer_file_name=args.trainer_file, model_file_name=args.model_file,
+                      sparse=args.sparse, model_keys=args.models)
+
+    return None
+
+
+def run_predict(args):
+    predict_file(args.input, args.output, model_file_name=args.model_file, chunk_size=args.chunk_size)
+
+    return None
+
+
+def cli(argv=None):
+    """Command line entry point:
+
+        python main.py preprocess [--sparse] [--impute-method chained]
+        python main.py optimize --models lr rf --search halving
+        python main.py optimize --search scheduled --workers node1:6000 node2:6000
+        python main.py ensemble --method voting --output voting.csv
+        python main.py refresh new_labels.csv
+        python main.py predict data/test.csv submission.csv
+
+    Only the estimators and backends a command uses are imported.
+    """
+    parser = argparse.ArgumentParser(description='Titanic survival models.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    features = argparse.ArgumentParser(add_help=False)
+    features.add_argument('--sparse', action='store_true')
+    features.add_argument('--impute-method', default='mice', choices=['mice', 'chained', 'mean'])
+
+    models = argparse.ArgumentParser(add_help=False, parents=[features])
+    models.add_argument('--models', nargs='+', default=DEFAULT_MODELS, choices=sorted(MODEL_CONFIGS))
+    models.add_argument('--folds', type=int, default=5)
+    models.add_argument('--verbose', type=int, default=3)
+    models.add_argument('--workers', nargs='+', metavar='HOST:PORT', help='remote workers (see executors.py)')
+    models.add_argument('--local-workers', type=int, metavar='N', help='run the fits on N local worker processes')
+    models.add_argument('--authkey-file', help='shared secret of the --workers (see executors.read_authkey)')
+
+    preprocess = subparsers.add_parser('preprocess', parents=[features], help='build the feature cache')
+    preprocess.set_defaults(run=run_preprocess)
+
+    optimize = subparsers.add_parser('optimize', parents=[models], help='tune the models\' hyper parameters')
+    optimize.add_argument('--search', default='grid', choices=sorted(SEARCH_STRATEGIES) + ['scheduled'])
+    optimize.add_argument('--report')
+    optimize.add_argument('--trial-store', metavar='SQLITE_FILE')
+    optimize.add_argument('--learning-curves', metavar='OUTPUT_DIR')
+    optimize.set_defaults(run=run_optimize)
+
+    ensemble = subparsers.add_parser('ensemble', parents=[models], help='combine the models into a submission')
+    ensemble.add_argument('--method', default='voting', choices=['voting', 'blending', 'stacking'])
+    ensemble.add_argument('--voting', default='hard', choices=['hard', 'soft', 'rank'])
+    ensemble.add_argument('--weights', type=float, nargs='+')
+    ensemble.add_argument('--feature-selection', action='store_true')
+    ensemble.add_argument('--output', default='voting.csv')
+    ensemble.add_argument('--save-predictor', metavar='MODEL_FILE',
+                          help='also fit the voting ensemble on a FeaturePipeline and save it for predict; '
+                               'needs --impute-method chained or mean and no --feature-selection')
+    ensemble.add_argument('--compile', action='store_true', help='save tree models as node arrays')
+    ensemble.set_defaults(run=run_ensemble)
+
+    refresh = subparsers.add_parser('refresh', help='update the saved predictor with new labelled passengers')
+    refresh.add_argument('input')
+    refresh.add_argument('--sparse', action='store_true')
+    refresh.add_argument('--models', nargs='+', default=DEFAULT_MODELS, choices=sorted(MODEL_CONFIGS))
+    refresh.add_argument('--trainer-file', default='temp/trainer.pkl')
+    refresh.add_argument('--model-file', default='temp/predictor.pkl')
+    refresh.set_defaults(run=run_refresh)
+
+    predict = subparsers.add_parser('predict', help='score a passenger CSV with a saved predictor')
+    predict.add_argument('input')
+    predict.add_argument('output')
+    predict.add_argument('--model-file', default='temp/predictor.pkl')
+    predict.add_argument('--chunk-size', type=int, default=10000)
+    predict.set_defaults(run=run_predict)
+
+    args = parser.parse_args(argv)
+    if getattr(args, 'save_predictor', None) and args.voting == 'rank':
+        parser.error('--voting rank ranks the whole test set at once; save the predictor with hard or soft voting')
+    if getattr(args, 'save_predictor', None) and args.impute_method == 'mice':
+        parser.error('--save-predictor imputes passengers one batch at a time, which MICE cannot do; '
+                     'use --impute-method chained or mean')
+    if getattr(args, 'save_predictor', None) and args.feature_selection:
+        parser.error('--save-predictor keeps every feature of the FeaturePipeline; drop --feature-selection')
+    args.run(args)
+
+    return None
 
 
 if __name__ == '__main__':
-    custom_classifier()
+    cli()
@@ -0,0 +1,327 @@
+from sklearn.base import clone
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV, ParameterGrid, ParameterSampler, \
+    StratifiedKFold, train_test_split
+from joblib import Parallel, delayed
+
+import numpy as np
+
+
+def fit_score(model, x, y, train, test):
+    """Fit [model] on the [train] rows and score it on the [test] rows. A
+    parameter set the estimator rejects scores NaN, as with GridSearchCV's
+    error_score.
+    """
+    try:
+        model.fit(x[train], y[train])
+    except Exception:
+        return np.nan
+    return model.score(x[test], y[test])
+
+
+def rank_scores(scores):
+    """Scores with NaN (failed fits) replaced by -inf, so they rank last.
+    """
+    return np.nan_to_num(np.asarray(scores, dtype=np.float64), nan=-np.inf)
+
+
+class SuccessiveHalvingSearch:
+    """Successive halving over a hyper parameter grid. Every candidate is first
+    scored with a small amount of [resource] (training rows, or the number of
+    trees when resource='n_estimators'); only the best 1/[factor] of them move on
+    to the next round, which gets [factor] times more resource. Within a round
+    the folds are scored one at a time, each over all remaining candidates on
+    [n_jobs] processes. From the second fold on, a candidate whose running fold
+    average falls below the best running average by more than [abandon_margin],
+    or by more than [abandon_z] standard errors of that accuracy over the test
+    rows scored so far if that is wider, is abandoned without scoring its
+    remaining folds. Every fold tests at least [min_test_rows] rows. Candidates
+    whose fit fails score NaN and rank last.
+
+    Exposes the parts of the GridSearchCV interface SurvivalClassifier uses.
+    """
+
+    def __init__(self, estimator, param_grid, cv=5, resource='n_samples', factor=3, min_resource=None,
+                 max_resource=None, n_candidates=None, abandon_margin=0.05, abandon_z=2.0, min_test_rows=30,
+                 random_state=0, n_jobs=None, verbose=0):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.resource = resource
+        self.factor = factor
+        self.min_resource = min_resource
+        self.max_resource = max_resource
+        self.n_candidates = n_candidates
+        self.abandon_margin = abandon_margin
+        self.abandon_z = abandon_z
+        self.min_test_rows = min_test_rows
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+
+        self.best_params_ = None
+        self.best_score_ = None
+        self.best_estimator_ = None
+        self.cv_results_ = []
+
+    def fit(self, x, y):
+        grid = dict(self.param_grid)
+        if self.resource == 'n_samples':
+            max_resource = self.max_resource or x.shape[0]
+        else:
+            values = grid.pop(self.resource, None)
+            max_resource = self.max_resource or (max(values) if values else
+                                                 self.estimator.get_params()[self.resource])
+
+        if self.n_candidates is None:
+            candidates = list(ParameterGrid(grid))
+        else:
+            candidates = list(ParameterSampler(grid, self.n_candidates, random_state=self.random_state))
+
+        n_rounds = int(np.ceil(np.log(max(len(candidates), 1)) / np.log(self.factor))) + 1
+        min_resource = self.min_resource or max(max_resource // self.factor ** (n_rounds - 1), 1)
+        if self.resource == 'n_samples':
+            min_resource = min(max(min_resource, self.cv * self.min_test_rows), max_resource)
+
+        rows = np.random.RandomState(self.random_state).permutation(x.shape[0])
+        self.cv_results_ = []
+        scores = []
+
+        for round_index in range(n_rounds):
+            last_round = round_index == n_rounds - 1 or len(candidates) == 1
+            amount = max_resource if last_round else min(int(min_resource * self.factor ** round_index),
+                                                         max_resource)
+            self.log('Halving round {0}: {1} candidates, {2}={3}'.format(
+                round_index, len(candidates), self.resource, amount), 1)
+
+            scores = self._score_round(candidates, x, y, rows, amount)
+            for params, score in zip(candidates, scores):
+                self.cv_results_.append({'round': round_index, 'params': params,
+                                         self.resource: amount, 'score': score})
+
+            if last_round:
+                break
+
+            keep = int(np.ceil(len(candidates) / float(self.factor)))
+            order = np.argsort(rank_scores(scores), kind='mergesort')[::-1][:keep]
+            candidates = [candidates[i] for i in order]
+
+        best = int(np.argmax(rank_scores(scores)))
+        self.best_params_ = dict(candidates[best])
+        self.best_score_ = scores[best]
+        if self.resource != 'n_samples':
+            self.best_params_[self.resource] = max_resource
+
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(x, y)
+
+        return self
+
+    def _score_round(self, candidates, x, y, rows, amount):
+        if self.resource == 'n_samples':
+            subset = np.sort(rows[:amount])
+            x, y, extra = x[subset], y[subset], {}
+        else:
+            extra = {self.resource: amount}
+
+        splits = list(StratifiedKFold(n_splits=self.cv).split(x, y))
+        fold_scores = [[] for _ in candidates]
+        remaining = list(range(len(candidates)))
+
+        test_rows = 0
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            for fold, (train, test) in enumerate(splits):
+                results = parallel(
+                    delayed(fit_score)(clone(self.estimator).set_params(**dict(candidates[index], **extra)),
+                                       x, y, train, test)
+                    for index in remaining)
+                for index, score in zip(remaining, results):
+                    fold_scores[index].append(score)
+
+                test_rows += len(test)
+                means = dict((index, np.mean(fold_scores[index])) for index in remaining)
+                best_score = max(rank_scores(list(means.values())))
+                margin = np.inf
+                if fold >= 1 and np.isfinite(best_score):
+                    margin = max(self.abandon_margin,
+                                 self.abandon_z * np.sqrt(2.0 * best_score * (1.0 - best_score) / test_rows))
+                for index in remaining:
+                    if np.isnan(means[index]):
+                        self.log('Fit failed for {0}'.format(candidates[index]), 1)
+                    elif means[index] < best_score - margin:
+                        self.log('Abandoned {0} after {1} folds'.format(candidates[index],
+                                                                       len(fold_scores[index])), 2)
+                remaining = [index for index in remaining
+                             if not np.isnan(means[index]) and means[index] >= best_score - margin]
+
+        scores = []
+        for index in range(len(candidates)):
+            score = np.mean(fold_scores[index])
+            if len(fold_scores[index]) < len(splits) and not np.isnan(score):
+                # Abandoned candidates always rank below finished ones
+                score -= 1.0
+            scores.append(score)
+
+        return scores
+
+    def predict(self, x):
+        return self.best_estimator_.predict(x)
+
+    def score(self, x, y):
+        return self.best_estimator_.score(x, y)
+
+    def log(self, msg, verbose):
+        if self.verbose >= verbose:
+            print(msg)
+
+        return None
+
+
+def is_boosting(estimator):
+    """XGBoost models grow with evaluation-set early stopping; everything else
+    with an n_estimators parameter is grown with warm_start.
+    """
+    return hasattr(estimator, 'get_booster')
+
+
+def fit_early_stopping(model, x_train, y_train, x_eval, y_eval, rounds):
+    """Fit an XGBoost model, stopping once the evaluation loss has not improved
+    for [rounds] rounds. Returns the number of boosting rounds kept.
+    """
+    if 'early_stopping_rounds' in model.get_params():
+        model.set_params(early_stopping_rounds=rounds)
+        model.fit(x_train, y_train, eval_set=[(x_eval, y_eval)], verbose=False)
+    else:
+        model.fit(x_train, y_train, eval_set=[(x_eval, y_eval)], early_stopping_rounds=rounds,
+                  verbose=False)
+
+    return model.best_iteration + 1
+
+
+def grow_fold(model, counts, x, y, train, test):
+    """Grow a warm_start [model] through the sorted n_estimators [counts] on
+    the [train] rows, scoring it on the [test] rows at each one. A parameter
+    set the estimator rejects scores NaN at every count.
+    """
+    scores = []
+    try:
+        for count in counts:
+            model.set_params(n_estimators=count).fit(x[train], y[train])
+            scores.append(model.score(x[test], y[test]))
+    except Exception:
+        return [np.nan] * len(counts)
+    return scores
+
+
+def boost_fold(model, x, y, train, test, rounds, validation_size=0.2, random_state=0):
+    """Boost [model] with early stopping on a stratified [validation_size]
+    split of the [train] rows, and score it on the [test] rows, which the
+    stopping point never sees. Returns the score and the number of rounds
+    kept, or NaN and None if the fit fails.
+    """
+    inner_train, inner_eval = train_test_split(train, test_size=validation_size, stratify=y[train],
+                                               random_state=random_state)
+    try:
+        kept = fit_early_stopping(model, x[inner_train], y[inner_train], x[inner_eval], y[inner_eval], rounds)
+    except Exception:
+        return np.nan, None
+    return model.score(x[test], y[test]), kept
+
+
+class GrowingEnsembleSearch:
+    """Grid search for tree ensembles that covers every n_estimators candidate
+    with a single fit per fold. Forests (and other warm_start estimators) are
+    grown tree by tree through the sorted n_estimators values, being scored at
+    each one; XGBoost is boosted up to the largest value with early stopping on
+    a split of each training fold, and n_estimators becomes the average number
+    of rounds kept. The folds are fitted on [n_jobs] processes, and parameter
+    sets whose fit fails score NaN and rank last. Estimators without
+    n_estimators fall back to GridSearchCV.
+
+    Exposes the parts of the GridSearchCV interface SurvivalClassifier uses.
+    """
+
+    def __init__(self, estimator, param_grid, cv=5, early_stopping_rounds=20, n_jobs=None, verbose=0):
+        self.estimator = estimator
+        self.param_grid = param_grid
+        self.cv = cv
+        self.early_stopping_rounds = early_stopping_rounds
+        self.n_jobs = n_jobs
+        self.verbose = verbose
+
+        self.best_params_ = None
+        self.best_score_ = None
+        self.best_estimator_ = None
+        self.cv_results_ = []
+
+    def fit(self, x, y):
+        if 'n_estimators' not in self.estimator.get_params():
+            search = GridSearchCV(self.estimator, self.param_grid, cv=self.cv, n_jobs=self.n_jobs,
+                                  verbose=self.verbose).fit(x, y)
+            self.best_params_, self.best_score_ = search.best_params_, search.best_score_
+            self.best_estimator_ = search.best_estimator_
+            self.cv_results_ = []
+            return self
+
+        grid = dict(self.param_grid)
+        counts = sorted(grid.pop('n_estimators', [self.estimator.get_params()['n_estimators']]))
+        splits = list(StratifiedKFold(n_splits=self.cv).split(x, y))
+
+        self.cv_results_ = []
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            for params in ParameterGrid(grid):
+                if is_boosting(self.estimator):
+                    self.cv_results_.append(self._boost(parallel, params, counts[-1], x, y, splits))
+                else:
+                    self.cv_results_.extend(self._grow(parallel, params, counts, x, y, splits))
+
+        best = self.cv_results_[int(np.argmax(rank_scores([result['score'] for result in self.cv_results_])))]
+        self.best_params_ = best['params']
+        self.best_score_ = best['score']
+        self.best_estimator_ = clone(self.estimator).set_params(**self.best_params_).fit(x, y)
+
+        return self
+
+    def _grow(self, parallel, params, counts, x, y, splits):
+        fold_scores = parallel(delayed(grow_fold)(clone(self.estimator).set_params(warm_start=True, **params),
+                                                  counts, x, y, train, test)
+                               for train, test in splits)
+        scores = np.mean(fold_scores, axis=0)
+
+        for count, score in zip(counts, scores):
+            self.log('{0} n_estimators={1}: {2}'.format(params, count, score), 2)
+        return [{'params': dict(params, n_estimators=count), 'score': score} for count, score in zip(counts, scores)]
+
+    def _boost(self, parallel, params, max_count, x, y, splits):
+        results = parallel(delayed(boost_fold)(clone(self.estimator).set_params(n_estimators=max_count, **params),
+                                               x, y, train, test, self.early_stopping_rounds)
+                           for train, test in splits)
+        scores, rounds = zip(*results)
+        if None in rounds:
+            self.log('Fit failed for {0}'.format(params), 1)
+            return {'params': dict(params, n_estimators=max_count), 'score': np.nan}
+
+        count = int(np.ceil(np.mean(rounds)))
+        self.log('{0} stopped after {1} rounds: {2}'.format(params, count, np.mean(scores)), 2)
+        return {'params': dict(params, n_estimators=count), 'score': np.mean(scores)}
+
+    def predict(self, x):
+        return self.best_estimator_.predict(x)
+
+    def score(self, x, y):
+        return self.best_estimator_.score(x, y)
+
+    def log(self, msg, verbose):
+        if self.verbose >= verbose:
+            print(msg)
+
+        return None
+
+
+# Search strategies available to SurvivalClassifier.optimize_models. Each entry is
+# called as strategy(model, hyper_parameters, cv=folds, n_jobs=..., verbose=...,
+# **search_options) and must return an object with the GridSearchCV interface.
+SEARCH_STRATEGIES = {
+    'grid': GridSearchCV,
+    'random': RandomizedSearchCV,
+    'halving': SuccessiveHalvingSearch,
+    'grow': GrowingEnsembleSearch
+}
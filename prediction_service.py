@@ -0,0 +1,120 @@
+from titanic_classifier import to_model_matrix
+from combiners import combine, ROW_WISE_VOTING
+from tree_export import CompiledEnsemble
+
+import joblib
+import numpy as np
+import pandas as pd
+import time
+
+
+class SurvivalPredictor:
+    """A trained feature pipeline (main.FeaturePipeline) together with the fitted
+    members of a voting ensemble. Loaded once, it scores passengers in batches
+    without retraining and without holding more than one batch in memory.
+    After compile, the members are scored by a tree_export.CompiledEnsemble
+    and the original estimators are dropped.
+    """
+
+    def __init__(self, pipeline, estimators, voting='hard', weights=None, dtype=np.float32, verbose=1):
+        if voting not in ROW_WISE_VOTING:
+            raise ValueError('{0} voting depends on the batch and cannot score passengers batch by batch'.format(
+                voting))
+        self.pipeline = pipeline
+        self.estimators = estimators
+        self.voting = voting
+        self.weights = weights
+        self.dtype = dtype
+        self.verbose = verbose
+        self.compiled = None
+
+    @classmethod
+    def from_classifier(cls, pipeline, classifier, voting='hard', weights=None, compiled=False):
+        """Wrap the members fitted by SurvivalClassifier.voting, compiling them
+        (checked against the classifier's test set) if [compiled].
+        """
+        predictor = cls(pipeline, classifier.ensemble.estimators, voting=voting, weights=weights,
+                        dtype=classifier.train_x.dtype)
+        if compiled:
+            predictor.compile(classifier.test_x)
+
+        return predictor
+
+    def compile(self, check_x=None):
+        """Flatten the tree members into node arrays. With [check_x] (a model
+        matrix), the compiled members must reproduce the original predictions
+        on it, or ValueError is raised.
+        """
+        self.compiled = CompiledEnsemble(self.estimators, voting=self.voting, weights=self.weights)
+        if check_x is not None:
+            self.compiled.check_parity(self.estimators, check_x)
+            self.log('Compiled ensemble matches the original on {0} rows'.format(check_x.shape[0]), 1)
+        self.estimators = None
+
+        return None
+
+    def save(self, file_name):
+        joblib.dump(self, file_name, compress=3)
+
+        return None
+
+    @staticmethod
+    def load(file_name):
+        return joblib.load(file_name)
+
+    def predict(self, passengers):
+        """Survival predictions for a DataFrame of passengers in the
+        data/test.csv layout, as a PassengerId/Survived DataFrame.
+        """
+        # Labelled passengers come back with the Train/Survived bookkeeping columns
+        features = self.pipeline.transform(passengers).drop(['Train', 'Survived'], axis=1, errors='ignore')
+        x = to_model_matrix(features, self.dtype)
+        if self.compiled is not None:
+            return pd.DataFrame({'PassengerId': np.asarray(passengers['PassengerId']),
+                                 'Survived': self.compiled.predict(x)})
+
+        predictions = np.vstack([estimator.predict(x) for estimator in self.estimators])
+        proba = None
+        if self.voting != 'hard':
+            proba = np.vstack([estimator.predict_proba(x)[:, 1] for estimator in self.estimators])
+
+        return pd.DataFrame({'PassengerId': np.asarray(passengers['PassengerId']),
+                             'Survived': combine(predictions, proba, weights=self.weights, voting=self.voting)})
+
+    def predict_batches(self, batches):
+        """Score an iterable of passenger DataFrames, yielding one result per
+        batch and logging its latency and throughput.
+        """
+        total_rows = 0
+        total_time = 0.0
+        for index, batch in enumerate(batches):
+            start = time.time()
+            result = self.predict(batch)
+            elapsed = time.time() - start
+
+            total_rows += len(batch)
+            total_time += elapsed
+            self.log('Batch {0}: {1} rows in {2:.3f}s ({3:.0f} rows/s)'.format(
+                index, len(batch), elapsed, len(batch) / max(elapsed, 1e-9)), 2)
+
+            yield result
+
+        self.log('Scored {0} rows in {1:.3f}s ({2:.0f} rows/s)'.format(
+            total_rows, total_time, total_rows / max(total_time, 1e-9)), 1)
+
+    def predict_csv(self, input_file_name, output_file_name, chunk_size=10000):
+        """Stream a passenger CSV through the predictor, [chunk_size] rows at a
+        time, appending each scored chunk to [output_file_name].
+        """
+        chunks = pd.read_csv(input_file_name, dtype={'Name': str, 'Ticket': str, 'Cabin': str},
+                             chunksize=chunk_size)
+        for index, result in enumerate(self.predict_batches(chunks)):
+            result.to_csv(output_file_name, index=False, mode='w' if index == 0 else 'a', header=index == 0)
+
+        return None
+
+    def log(self, msg, verbose):
+        if self.verbose >= verbose:
+            print(msg)
+
+        return None
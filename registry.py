@@ -0,0 +1,54 @@
+import importlib
+
+# Estimators, imputers and plotting backends by kind and name, as
+# 'module:attribute' import paths. Nothing is imported until a configuration
+# asks for it through load or create, so that a run which only scores cached
+# features never pays for xgboost, fancyimpute or matplotlib.
+BACKENDS = {
+    'model': {
+        'logistic_regression': 'sklearn.linear_model:LogisticRegression',
+        'random_forest': 'sklearn.ensemble:RandomForestClassifier',
+        'adaboost': 'sklearn.ensemble:AdaBoostClassifier',
+        'gradient_boosting': 'sklearn.ensemble:GradientBoostingClassifier',
+        'bagging': 'sklearn.ensemble:BaggingClassifier',
+        'voting': 'sklearn.ensemble:VotingClassifier',
+        'svc': 'sklearn.svm:SVC',
+        'mlp': 'sklearn.neural_network:MLPClassifier',
+        'xgboost': 'xgboost:XGBClassifier'
+    },
+    'imputer': {
+        'mice': 'fancyimpute.mice:MICE',
+        'chained': 'imputation:ColumnImputer'
+    },
+    'plot': {
+        'figure': 'matplotlib.figure:Figure'
+    }
+}
+
+_loaded = {}
+
+
+def register(kind, name, import_path):
+    """Make 'module:attribute' available as [name] of [kind].
+    """
+    BACKENDS.setdefault(kind, {})[name] = import_path
+    _loaded.pop((kind, name), None)
+
+    return None
+
+
+def load(kind, name):
+    """Import (once) and return the class or function registered as [name].
+    """
+    if (kind, name) not in _loaded:
+        if name not in BACKENDS.get(kind, {}):
+            raise ValueError('Unknown {0}: {1}'.format(kind, name))
+
+        module_name, attribute = BACKENDS[kind][name].split(':')
+        _loaded[(kind, name)] = getattr(importlib.import_module(module_name), attribute)
+
+    return _loaded[(kind, name)]
+
+
+def create(kind, name, **params):
+    return load(kind, name)(**params)
@@ -0,0 +1,204 @@
+from sklearn.base import clone
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from joblib import effective_n_jobs
+
+from fold_cache import data_fingerprint, model_key
+from executors import LocalExecutor
+
+import multiprocessing
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def expected_cost(model, n_rows, n_features):
+    """Rough relative cost of one fit, only used to order the work queue:
+    ensembles scale with their number of trees times n log n, iterative
+    linear models with their iteration budget times the data size.
+    """
+    params = model.get_params()
+    if params.get('n_estimators'):
+        return params['n_estimators'] * n_rows * np.log2(max(n_rows, 2)) * np.sqrt(n_features)
+    return (params.get('max_iter') or 100) * n_rows * n_features / 10.0
+
+
+def limit_memory(megabytes):
+    """Cap the data segment of the current (worker) process, so that a fit
+    exceeding it raises MemoryError instead of swapping the machine.
+    Memory-mapped inputs are not counted against the cap. A no-op in the main
+    process, where joblib runs the tasks when it has a single core.
+
+    Returns the previous limits, to be restored with restore_memory once the
+    task is done: joblib and executors.serve reuse their workers for other
+    tasks.
+    """
+    if resource is None or megabytes is None or multiprocessing.current_process().name == 'MainProcess':
+        return None
+
+    previous = resource.getrlimit(resource.RLIMIT_DATA)
+    limit = int(megabytes * 1024 ** 2)
+    if previous[1] != resource.RLIM_INFINITY:
+        limit = min(limit, previous[1])
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, previous[1]))
+
+    return previous
+
+
+def restore_memory(previous):
+    if previous is not None:
+        resource.setrlimit(resource.RLIMIT_DATA, previous)
+
+    return None
+
+
+def fit_task(model, x, y, train, test, worker_memory_mb):
+    """Fit one (model, parameter set, fold) task and return its test fold
+    score, or None when the fit failed (an invalid parameter set, or the worker
+    ran out of its memory allowance), together with the fit time. Without
+    [test] the fitted model is returned instead, and errors are raised.
+    """
+    if 'n_jobs' in model.get_params():
+        # The scheduler owns the cores; nested pools would oversubscribe them
+        model.set_params(n_jobs=1)
+
+    previous = limit_memory(worker_memory_mb)
+    start = time.time()
+    try:
+        model.fit(x[train], y[train])
+    except Exception:
+        if test is None:
+            raise
+        return None, time.time() - start
+    finally:
+        restore_memory(previous)
+    seconds = time.time() - start
+
+    return model if test is None else model.score(x[test], y[test]), seconds
+
+
+class ScheduledSearch:
+    """Result of one model's search in SearchScheduler, with the parts of the
+    GridSearchCV interface SurvivalClassifier uses.
+    """
+
+    def __init__(self, best_params, best_score, best_estimator, cv_results):
+        self.best_params_ = best_params
+        self.best_score_ = best_score
+        self.best_estimator_ = best_estimator
+        self.cv_results_ = cv_results
+
+    def predict(self, x):
+        return self.best_estimator_.predict(x)
+
+    def score(self, x, y):
+        return self.best_estimator_.score(x, y)
+
+
+class SearchScheduler:
+    """Grid search over several models at once. The (model, parameter set,
+    fold) fits of all models are flattened into one work queue, ordered by
+    expected_cost with the largest first so that short grids fill the gaps left
+    by long ones, and run on a single process pool (or [executor], see
+    executors). Data larger than
+    [max_nbytes] is memory-mapped into the workers, and every worker is capped
+    at [worker_memory_mb] of private memory while it fits; fits that exceed it,
+    or that fail for an invalid parameter set, are dropped from the search.
+
+    With a trial_store.TrialStore, fits already stored for the data set and
+    fold scheme are not repeated, and new ones are recorded after every batch
+    of [batch_size] tasks, so an interrupted search resumes where it stopped.
+    Fits that failed are recorded too, but run again by the next search.
+    """
+
+    def __init__(self, n_jobs=-1, worker_memory_mb=None, max_nbytes='1M', store=None, batch_size=None,
+                 executor=None, verbose=0):
+        self.n_jobs = n_jobs
+        self.worker_memory_mb = worker_memory_mb
+        self.max_nbytes = max_nbytes
+        self.store = store
+        self.batch_size = batch_size
+        self.executor = executor or LocalExecutor(n_jobs=n_jobs, max_nbytes=max_nbytes, verbose=verbose)
+        self.verbose = verbose
+
+    def search(self, models, param_grids, x, y, cv=5):
+        """Return one ScheduledSearch per model, its best estimator refitted on
+        all of [x].
+        """
+        splits = list(StratifiedKFold(n_splits=cv).split(x, y))
+        grids = [list(ParameterGrid(param_grid or {})) for param_grid in param_grids]
+        candidates = [[clone(model).set_params(**params) for params in grid] for model, grid in zip(models, grids)]
+        keys = [[repr(model_key(estimator)) for estimator in model_candidates] for model_candidates in candidates]
+
+        dataset = data_fingerprint(x, y)
+        fold_scheme = 'stratified-{0}'.format(cv)
+        scores = self.store.scores(dataset, fold_scheme) if self.store is not None else {}
+
+        tasks = [(index, candidate, fold)
+                 for index in range(len(models))
+                 for candidate in range(len(candidates[index]))
+                 for fold in range(len(splits))
+                 if (keys[index][candidate], fold) not in scores]
+        costs = [expected_cost(candidates[index][candidate], len(splits[fold][0]), x.shape[1])
+                 for index, candidate, fold in tasks]
+        tasks = [tasks[i] for i in np.argsort(costs, kind='mergesort')[::-1]]
+        self.log('Scheduling {0} fits of {1} models, {2} stored'.format(len(tasks), len(models), len(scores)), 1)
+
+        batch_size = self.batch_size or (4 * effective_n_jobs(self.n_jobs) if self.store is not None else len(tasks))
+        for start in range(0, len(tasks), max(batch_size, 1)):
+            batch = tasks[start:start + batch_size]
+            results = self.executor.map(
+                fit_task, [{'model': clone(candidates[index][candidate]), 'train': splits[fold][0],
+                            'test': splits[fold][1], 'worker_memory_mb': self.worker_memory_mb}
+                           for index, candidate, fold in batch],
+                x=x, y=y)
+
+            for (index, candidate, fold), (score, seconds) in zip(batch, results):
+                scores[(keys[index][candidate], fold)] = score
+            if self.store is not None:
+                self.store.record([(dataset, candidates[index][candidate], fold_scheme, fold,
+                                    grids[index][candidate], score, seconds)
+                                   for (index, candidate, fold), (score, seconds) in zip(batch, results)])
+
+        cv_results = []
+        for index, grid in enumerate(grids):
+            results = []
+            for candidate, params in enumerate(grid):
+                fold_scores = [scores[(keys[index][candidate], fold)] for fold in range(len(splits))]
+                results.append({'params': params,
+                                'score': np.nan if None in fold_scores else np.mean(fold_scores)})
+
+            failed = [result for result in results if np.isnan(result['score'])]
+            if failed:
+                self.log('{0} parameter sets of {1} failed to fit or exceeded the worker memory cap'.format(
+                    len(failed), type(models[index]).__name__), 1)
+            cv_results.append(results)
+
+        best = [max(results, key=lambda result: np.nan_to_num(result['score'], nan=-np.inf))
+                for results in cv_results]
+        order = np.argsort([-expected_cost(clone(model).set_params(**result['params']), x.shape[0], x.shape[1])
+                            for model, result in zip(models, best)], kind='mergesort')
+        refits = self.executor.map(
+            fit_task, [{'model': clone(models[index]).set_params(**best[index]['params']),
+                        'train': np.arange(x.shape[0]), 'test': None, 'worker_memory_mb': None}
+                       for index in order],
+            x=x, y=y)
+
+        searches = [None] * len(models)
+        for index, (estimator, seconds) in zip(order, refits):
+            # Give the refitted model its own n_jobs back for prediction
+            if 'n_jobs' in estimator.get_params():
+                estimator.set_params(n_jobs=models[index].get_params()['n_jobs'])
+            searches[index] = ScheduledSearch(best[index]['params'], best[index]['score'], estimator,
+                                              cv_results[index])
+
+        return searches
+
+    def log(self, msg, verbose):
+        if self.verbose >= verbose:
+            print(msg)
+
+        return None
@@ -0,0 +1,58 @@
+from sklearn.datasets import make_classification
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from scipy import sparse
+
+from combiners import combine
+from tree_export import CompiledEnsemble
+
+import numpy as np
+import pytest
+
+
+def make_data(kind):
+    x, y = make_classification(400, 12, n_informative=6, random_state=0)
+    x = np.round(x, 1).astype(np.float32)
+    if kind == 'nan':
+        x[np.random.RandomState(1).rand(*x.shape) < 0.1] = np.nan
+    elif kind == 'csr':
+        x[np.abs(x) < 0.5] = 0
+        x = sparse.csr_matrix(x)
+    return x, y
+
+
+def fit_members(x, y, kind):
+    xgboost = pytest.importorskip('xgboost')
+    members = [RandomForestClassifier(n_estimators=15, max_depth=6, random_state=0),
+               xgboost.XGBClassifier(n_estimators=25, max_depth=4, random_state=0)]
+    if kind != 'nan':
+        members.append(LogisticRegression(max_iter=500))
+    return [member.fit(x, y) for member in members]
+
+
+@pytest.mark.parametrize('kind', ['dense', 'nan', 'csr'])
+@pytest.mark.parametrize('voting', ['hard', 'soft'])
+def test_compiled_matches_estimators(kind, voting):
+    x, y = make_data(kind)
+    estimators = fit_members(x, y, kind)
+    compiled = CompiledEnsemble(estimators, voting=voting, batch_size=64)
+
+    predictions, proba = compiled.member_predictions(x)
+    for index, estimator in enumerate(estimators):
+        np.testing.assert_array_equal(predictions[index], estimator.predict(x))
+        np.testing.assert_allclose(proba[index], estimator.predict_proba(x)[:, 1], rtol=1e-5, atol=1e-6)
+
+    expected = combine(np.vstack([estimator.predict(x) for estimator in estimators]),
+                       np.vstack([estimator.predict_proba(x)[:, 1] for estimator in estimators]), voting=voting)
+    np.testing.assert_array_equal(compiled.predict(x), expected)
+    compiled.check_parity(estimators, x)
+
+
+def test_check_parity_detects_mismatch():
+    x, y = make_data('dense')
+    estimators = fit_members(x, y, 'dense')
+    compiled = CompiledEnsemble(estimators)
+
+    other = RandomForestClassifier(n_estimators=15, max_depth=2, random_state=1).fit(x, y)
+    with pytest.raises(ValueError):
+        compiled.check_parity([other] + estimators[1:], x)
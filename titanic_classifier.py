@@ -1,25 +1,89 @@
-from sklearn.model_selection import train_test_split, cross_val_score, GridSearchCV, learning_curve, ShuffleSplit, \
-    StratifiedKFold
-from sklearn.ensemble import VotingClassifier, BaggingClassifier
-from sklearn.feature_selection import RFE
-from sklearn.neural_network import MLPClassifier
+from sklearn.model_selection import train_test_split
+
+from model_search import SEARCH_STRATEGIES
+from fold_cache import FoldCache
+from ensemble import FittedEnsemble
+from combiners import blend, write_submission
+from instrumentation import Tracer, shape_counters
+from feature_ranking import FeatureSelector
+from scheduler import SearchScheduler
+from trial_store import TrialStore
+
+import registry
+
+from scipy import sparse
 
 import pandas as pd
 import numpy as np
 import datetime
-import matplotlib.pyplot as plt
+import os
+
+
+def to_model_matrix(data, dtype=np.float32):
+    """Turn a feature DataFrame into the [dtype] matrix handed to the models.
+    Categorical columns (see main.sparse_dummies) are one-hot encoded straight
+    into CSR blocks, in which case the whole matrix is returned as CSR.
+    """
+    if not isinstance(data, pd.DataFrame):
+        return data
+
+    sparse_cols = [col for col in data if isinstance(data[col].dtype, pd.CategoricalDtype)]
+    if not sparse_cols:
+        return np.array(data, dtype=dtype)
+
+    blocks = [sparse.csr_matrix(np.array(data.drop(sparse_cols, axis=1), dtype=dtype))]
+    for col in sparse_cols:
+        codes = np.asarray(data[col].cat.codes)
+        rows = np.flatnonzero(codes >= 0)
+        blocks.append(sparse.csr_matrix(
+            (np.ones(len(rows), dtype=dtype), (rows, codes[rows])),
+            shape=(len(codes), len(data[col].cat.categories))))
+
+    return sparse.hstack(blocks, format='csr', dtype=dtype)
+
+
+def model_feature_names(data):
+    """Column names matching the layout produced by to_model_matrix.
+    """
+    if not isinstance(data, pd.DataFrame):
+        return np.arange(data.shape[1]).astype(str)
+
+    sparse_cols = [col for col in data if isinstance(data[col].dtype, pd.CategoricalDtype)]
+    names = [col for col in data if col not in sparse_cols]
+    for col in sparse_cols:
+        names += ['{0}_{1}'.format(col, category) for category in data[col].cat.categories]
+
+    return np.array(names)
 
 
 class SurvivalClassifier:
-    def __init__(self, train_x, train_y, test_x, verbose=3):
+    def __init__(self, train_x, train_y, test_x, verbose=3, dtype=np.float32, tracer=None, executor=None,
+                 test_ids=None):
         self.models = []
         self.model_names = []
         self.hyper_parameters = []
-        self.train_x = train_x
-        self.train_y = train_y
-        self.test_x = test_x
+        self.feature_names = model_feature_names(train_x)
+        # PassengerIds of the test rows, carried as the index from main.ingest_data
+        if test_ids is None and isinstance(test_x, pd.DataFrame):
+            test_ids = test_x.index
+        self.test_ids = None if test_ids is None else np.asarray(test_ids)
+        self.tracer = Tracer() if tracer is None else tracer
+        self.feature_selector = FeatureSelector(verbose=verbose)
+        self.executor = executor
         self.verbose = verbose
         self.result = []
+        self.set_data(to_model_matrix(train_x, dtype), train_y, to_model_matrix(test_x, dtype), dtype)
+
+    def set_data(self, train_x, train_y, test_x, dtype=np.float32):
+        """Install model matrices, resetting everything fitted on the old ones.
+        """
+        self.fold_cache = FoldCache(train_x, train_y, test_x, dtype=dtype, executor=self.executor)
+        self.train_x = self.fold_cache.train_x
+        self.train_y = self.fold_cache.train_y
+        self.test_x = self.fold_cache.test_x
+        self.ensemble = FittedEnsemble(self.fold_cache, tracer=self.tracer)
+
+        return None
 
     def append_model(self, model, model_name=None, hyper_parameters=None):
         self.models.append(model)
@@ -28,190 +92,232 @@ class SurvivalClassifier:
 
         return None
 
-    def optimize_models(self, folds=5):
+    def optimize_models(self, folds=5, search='grid', report_file_name=None, trial_store=None, **search_options):
+        """Tune every appended model on its hyper parameter grid. [search] names
+        one of model_search.SEARCH_STRATEGIES ('grid', 'random', 'halving', 'grow')
+        or is a strategy callable itself; [search_options] are passed on to it,
+        e.g. n_iter for 'random', resource/factor for 'halving' or
+        early_stopping_rounds for 'grow'. search='scheduled' instead runs the
+        grid searches of all models together on one work queue (see
+        scheduler.SearchScheduler, which takes e.g. worker_memory_mb as a
+        search option). A [trial_store] (trial_store.TrialStore or its file
+        name) implies search='scheduled': trials stored by earlier runs on the
+        same data are reused instead of being fitted again. The trace, with the
+        optimized parameters and scores of every model, is written to
+        [report_file_name] (JSON, or CSV for a .csv name).
+        """
+        strategy = SEARCH_STRATEGIES[search] if search in SEARCH_STRATEGIES else search
+
         x_train_cv, x_test_cv, y_train_cv, y_test_cv = train_test_split(
             self.train_x, self.train_y, test_size=0.2, random_state=50)
 
-        report_file = open('report{0}.txt'.format(datetime.datetime.now()), 'w+')
+        searches = [None] * len(self.models)
+        if trial_store is not None:
+            search = 'scheduled'
+            if not isinstance(trial_store, TrialStore):
+                trial_store = TrialStore(trial_store)
+        if search == 'scheduled':
+            with self.tracer.stage('scheduled_search', models=len(self.models), **shape_counters(x_train_cv)):
+                scheduler = SearchScheduler(store=trial_store, executor=self.executor, verbose=self.verbose,
+                                            **search_options)
+                searches = scheduler.search(self.models, self.hyper_parameters, x_train_cv, y_train_cv, cv=folds)
+            with self.tracer.stage('cross_val_score', folds=folds):
+                self.fold_cache.fit_folds([optimized_model.best_estimator_ for optimized_model in searches], folds)
 
         for index, model in enumerate(self.models):
             model_name = self.model_names[index]
             self.log('Model optimization: {0}'.format(model_name), 1)
 
-            optimized_model = GridSearchCV(model, self.hyper_parameters[index], cv=folds,
-                                           n_jobs=-1, verbose=self.verbose)
+            with self.tracer.stage('optimize', model=model_name, search=str(search),
+                                   **shape_counters(x_train_cv)) as event:
+                optimized_model = searches[index]
+                if optimized_model is None:
+                    optimized_model = strategy(model, self.hyper_parameters[index], cv=folds,
+                                               n_jobs=-1, verbose=self.verbose, **search_options)
+                    optimized_model.fit(x_train_cv, y_train_cv)
+
+                optimized_model.predict(x_test_cv)
 
-            optimized_model.fit(x_train_cv, y_train_cv)
-            optimized_model.predict(x_test_cv)
+                best_estimator = optimized_model.best_estimator_
 
-            best_estimator = optimized_model.best_estimator_
+                with self.tracer.stage('cross_val_score', model=model_name, folds=folds):
+                    k_fold_score = np.mean(self.fold_cache.cross_val_score(best_estimator, folds))
 
-            k_fold_score = np.mean(cross_val_score(
-                best_estimator,
-                np.append(x_train_cv, x_test_cv, axis=0),
-                np.append(y_train_cv, y_test_cv), cv=folds, n_jobs=-1))
+                hold_out_score = optimized_model.score(x_test_cv, y_test_cv)
+                event.update(best_params=str(optimized_model.best_params_), hold_out_accuracy=hold_out_score,
+                             k_fold_accuracy=k_fold_score)
 
             self.log('{0} optimized parameters: {1}'.format(model_name, optimized_model.best_params_), 2)
-            self.log('{0} Accuracy: {1}'.format(model_name, optimized_model.score(x_test_cv, y_test_cv)), 1)
+            self.log('{0} Accuracy: {1}'.format(model_name, hold_out_score), 1)
             self.log('{0} Accuracy: ({1}-fold): {2}'.format(model_name, str(folds), k_fold_score), 2)
 
             self.models[index] = best_estimator
 
-            report_file.write('{0} optimized parameters: {1}'.format(model_name, optimized_model.best_params_))
-
-        report_file.close()
+        self.tracer.save(report_file_name or 'report{0}.json'.format(datetime.datetime.now()))
 
         return None
 
-    def plot_learning_curves(self, folds=5):
-        for index, model in enumerate(self.models):
-            model_name = self.model_names[index]
-
-            plt.figure()
-            plt.title(model_name)
-            plt.xlabel("Training examples")
-            plt.ylabel("Score")
-
-            cv = ShuffleSplit(n_splits=10, test_size=0.2, random_state=13)
-
-            train_sizes, train_scores, test_scores = learning_curve(
-                model, self.train_x, self.train_y, n_jobs=-1, cv=cv)
+    def plot_learning_curves(self, output_dir='temp/learning_curves', formats=('png', 'svg'),
+                             train_sizes=np.linspace(0.1, 1.0, 5), n_jobs=-1):
+        """Compute every model's learning curve on 10 shuffle splits in one
+        parallel pass (see FoldCache.learning_curves) and write one figure per
+        model and format to [output_dir], without a display. The raw scores go
+        to learning_curves.npz as <model>/train_sizes, <model>/train_scores and
+        <model>/test_scores.
+        """
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        with self.tracer.stage('learning_curves', models=len(self.models)):
+            curves = self.fold_cache.learning_curves(self.models, train_sizes, 10, n_jobs=n_jobs, kind='shuffle',
+                                                     test_size=0.2, random_state=13)
+
+        arrays = {}
+        for model_name, (train_sizes, train_scores, test_scores) in zip(self.model_names, curves):
+            arrays['{0}/train_sizes'.format(model_name)] = train_sizes
+            arrays['{0}/train_scores'.format(model_name)] = train_scores
+            arrays['{0}/test_scores'.format(model_name)] = test_scores
 
             train_scores_mean = np.mean(train_scores, axis=1)
             train_scores_std = np.std(train_scores, axis=1)
             test_scores_mean = np.mean(test_scores, axis=1)
             test_scores_std = np.std(test_scores, axis=1)
 
-            plt.grid()
-            plt.fill_between(train_sizes, train_scores_mean - train_scores_std,
-                             train_scores_mean + train_scores_std, alpha=0.1,
-                             color="r")
-            plt.fill_between(train_sizes, test_scores_mean - test_scores_std,
-                             test_scores_mean + test_scores_std, alpha=0.1, color="g")
-            plt.plot(train_sizes, train_scores_mean, 'o-', color="r",
-                     label="Training score")
-            plt.plot(train_sizes, test_scores_mean, 'o-', color="g",
-                     label="Cross-validation score")
+            figure = registry.create('plot', 'figure')
+            axes = figure.add_subplot(1, 1, 1)
+            axes.set_title(model_name)
+            axes.set_xlabel("Training examples")
+            axes.set_ylabel("Score")
 
-            plt.legend(loc="best")
+            axes.grid()
+            axes.fill_between(train_sizes, train_scores_mean - train_scores_std,
+                              train_scores_mean + train_scores_std, alpha=0.1,
+                              color="r")
+            axes.fill_between(train_sizes, test_scores_mean - test_scores_std,
+                              test_scores_mean + test_scores_std, alpha=0.1, color="g")
+            axes.plot(train_sizes, train_scores_mean, 'o-', color="r",
+                      label="Training score")
+            axes.plot(train_sizes, test_scores_mean, 'o-', color="g",
+                      label="Cross-validation score")
 
-        plt.show()
+            axes.legend(loc="best")
 
-        return None
+            for file_format in formats:
+                file_name = os.path.join(output_dir, '{0}.{1}'.format(model_name.replace(' ', '_'), file_format))
+                figure.savefig(file_name)
+                self.log('Learning curve written to {0}'.format(file_name), 2)
 
-    def accuracy_report(self, folds=5, test_size=0.2):
+        np.savez(os.path.join(output_dir, 'learning_curves.npz'), **arrays)
 
-        x_train_cv, x_test_cv, y_train_cv, y_test_cv = train_test_split(
-            self.train_x, self.train_y, test_size=test_size, random_state=50)
+        return curves
 
+    def accuracy_report(self, folds=5):
         for index, model in enumerate(self.models):
             model_name = self.model_names[index]
             self.log('Model report: {0}'.format(model_name), 1)
 
-            k_fold_score = np.mean(cross_val_score(
-                model,
-                np.append(x_train_cv, x_test_cv, axis=0),
-                np.append(y_train_cv, y_test_cv), cv=folds, n_jobs=-1))
+            with self.tracer.stage('cross_val_score', model=model_name, folds=folds):
+                k_fold_score = np.mean(self.fold_cache.cross_val_score(model, folds))
 
             # self.log('{0} Accuracy: {1}'.format(model_name, optimized_model.score(x_test_cv, y_test_cv)), 1)
             self.log('{0} Accuracy: ({1}-fold): {2}'.format(model_name, str(folds), k_fold_score), 2)
 
         return None
 
-    def feature_selection(self):
-        for index, model in enumerate(self.models):
-            model_name = self.model_names[index]
+    def feature_selection(self, folds=5, combine='union'):
+        """Cross-validated feature elimination for every model (see
+        feature_ranking.FeatureSelector). The per-model selections are combined
+        ('union' or 'intersection') into one mask, and train_x/test_x are
+        reduced to it so that later fits run on the selected features only.
+        """
+        self.feature_selector.cv = folds
+        with self.tracer.stage('feature_selection', models=len(self.models), **shape_counters(self.train_x)):
+            masks = self.feature_selector.select(self.models, self.model_names, self.train_x, self.train_y)
+
+        for model_name, model_mask in zip(self.model_names, masks):
+            print('Selected Features for model: {0}'.format(model_name))
+            print(self.feature_names[model_mask])
 
-            classifier = model
-            random_feature_elimination = RFE(classifier)
-            random_feature_elimination = random_feature_elimination.fit(self.train_x, self.train_y)
+        mask = np.any(masks, axis=0) if combine == 'union' else np.all(masks, axis=0)
+        self.feature_names = self.feature_names[mask]
+        self.set_data(self.train_x[:, mask], self.train_y, self.test_x[:, mask], self.train_x.dtype)
 
-            print('Selected Features for model: {0}'.format(model_name))
-            print(self.train_x.ix[:, np.where(random_feature_elimination.support_)[0]].columns.values)
+        return mask
 
     def get_classifier(self, voting='hard', weights=None):
         model_with_name = []
         for index, model in enumerate(self.models):
             model_with_name.append(tuple([self.model_names[index], model]))
 
-        voting_classifier = VotingClassifier(estimators=model_with_name, voting=voting, weights=weights)
+        voting_classifier = registry.create('model', 'voting', estimators=model_with_name, voting=voting,
+                                            weights=weights)
         return voting_classifier
 
-    def blending(self, n_folds=10):
-        input_train_x = np.array(self.train_x)
+    def blending(self, n_folds=10, n_jobs=-1):
+        """Blend the out-of-fold probabilities of every model with an MLP. The
+        (model, fold) fits run in parallel through the fold cache.
+        """
         input_train_y = self.train_y
-        input_test_x = np.array(self.test_x)
-
-        skf = StratifiedKFold(n_splits=n_folds)
-
-        data_set_blend_train = np.zeros((input_train_x.shape[0], len(self.models)))
-        data_set_blend_test = np.zeros((input_test_x.shape[0], len(self.models)))
-
-        for j, model in enumerate(self.models):
-            data_set_blend_test_j = np.zeros((input_test_x.shape[0], n_folds))
-
-            for i, (train, test) in enumerate(skf.split(input_train_x, input_train_y)):
-                x_train = input_train_x[train]
-                y_train = input_train_y[train]
-
-                x_test = input_train_x[test]
-                # y_test = input_train_y[test]
-
-                model.fit(x_train, y_train)
+        with self.tracer.stage('blending folds', folds=n_folds, models=len(self.models)):
+            self.fold_cache.fit_folds(self.models, n_folds, n_jobs=n_jobs)
 
-                data_set_blend_train[test, j] = model.predict_proba(x_test)[:, 1]
-                data_set_blend_test_j[:, i] = model.predict_proba(input_test_x)[:, 1]
-
-            data_set_blend_test[:, j] = data_set_blend_test_j.mean(1)
-
-        blender = MLPClassifier(hidden_layer_sizes=300)
-        blender.fit(data_set_blend_train, input_train_y)
-
-        y_prediction = blender.predict(data_set_blend_test)
-        # y_prediction = (y_prediction - y_prediction.min()) / (y_prediction.max() - y_prediction.min())
+        train_proba, test_proba = [np.vstack(proba) for proba in zip(
+            *[self.fold_cache.out_of_fold(model, n_folds) for model in self.models])]
+        y_prediction = blend(train_proba, input_train_y, test_proba)
 
         self.result = y_prediction
 
         return None
 
-    def stacking(self):
-        input_train_x = np.array(self.train_x)
-        input_train_y = self.train_y
-        input_test_x = np.array(self.test_x)
-
-        x_train_a, x_train_b, y_train_a, y_train_b = train_test_split(
-            input_train_x, input_train_y, test_size=0.5, random_state=50)
-
-        data_set_stack_train = np.zeros((x_train_b.shape[0], len(self.models)))
-        data_set_stack_test = np.zeros((input_test_x.shape[0], len(self.models)))
+    def stacking(self, n_jobs=-1):
+        """Train every model on one half of the training set and blend their
+        probabilities on the other half. The models are fitted in parallel.
+        """
+        holdout = {'kind': 'shuffle', 'test_size': 0.5, 'random_state': 50}
+        with self.tracer.stage('stacking fits', models=len(self.models)):
+            self.fold_cache.fit_folds(self.models, 1, n_jobs=n_jobs, **holdout)
 
+        results = []
         for index, model in enumerate(self.models):
             self.log('Stacking model: {0}'.format(self.model_names[index]), 1)
+            results.append(self.fold_cache.fold(model, 1, 0, **holdout))
 
-            model.fit(x_train_a, y_train_a)
-            data_set_stack_train[:, index] = model.predict_proba(x_train_b)[:, 1]
-            data_set_stack_test[:, index] = model.predict_proba(input_test_x)[:, 1]
+        y_train_b = self.train_y[self.fold_cache.splits(1, **holdout)[0][1]]
+        self.result = blend(np.vstack([result['proba'] for result in results]), y_train_b,
+                            np.vstack([result['test_proba'] for result in results]))
 
-        blender = MLPClassifier(hidden_layer_sizes=300)
-        blender.fit(data_set_stack_train, y_train_b)
+        return None
 
-        self.result = blender.predict(data_set_stack_test)
+    def flush_result(self, output_file_name):
+        """Write the last result as a submission, keyed by the test set's
+        PassengerIds.
+        """
+        if self.test_ids is None:
+            raise ValueError('No PassengerIds for the test set; pass test_ids or an indexed test DataFrame')
+        write_submission(output_file_name, self.test_ids, self.result)
 
         return None
 
-    def flush_result(self, output_file_name, test_file_name):
-        ensemble = pd.read_csv(test_file_name)[['PassengerId']].assign(
-            Survived=self.result)
-        ensemble.to_csv(output_file_name, index=False)
-
     def voting(self, voting='hard', weights=None):
-        voting_classifier = self.get_classifier(voting=voting, weights=weights)
-        voting_classifier = voting_classifier.fit(self.train_x, self.train_y)
-
-        self.result = voting_classifier.predict(self.test_x)
+        """Vote with the appended models. Members are fitted once and their test
+        set predictions are kept, so calling this again with other weights or
+        another voting mode does not refit anything.
+        """
+        with self.tracer.stage('voting', voting=voting, weights=str(weights)):
+            self.ensemble.fit(self.models, self.model_names, self.train_x, self.train_y, self.test_x)
+            self.result = self.ensemble.predict(voting=voting, weights=weights)
 
         return None
 
+    def search_voting_weights(self, candidates=(0, 1, 2, 3), voting='hard', n_folds=5):
+        """Find the voting weights that maximize out-of-fold accuracy.
+        """
+        weights, score = self.ensemble.search_weights(self.models, self.train_y, candidates=candidates,
+                                                      voting=voting, n_folds=n_folds)
+        self.log('Best {0} voting weights: {1} ({2}-fold accuracy {3})'.format(voting, weights, n_folds, score), 1)
+
+        return weights
+
     def log(self, msg, verbose):
         if self.verbose >= verbose:
             print(msg)
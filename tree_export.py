@@ -0,0 +1,208 @@
+from scipy import sparse
+
+from combiners import combine, ROW_WISE_VOTING
+
+import json
+import numpy as np
+
+
+def float32_threshold(threshold, strict=False):
+    """The float32 t such that, for float32 x, x <= t is the same test as
+    x <= [threshold] (sklearn, which compares float32 features to float64
+    thresholds) or, with [strict], as x < [threshold] (XGBoost, whose
+    thresholds are float32 themselves).
+    """
+    threshold = np.asarray(threshold, dtype=np.float64)
+    rounded = threshold.astype(np.float32)
+    if strict:
+        return np.nextafter(rounded, np.float32(-np.inf))
+    return np.where(rounded > threshold, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+
+def sklearn_trees(estimator):
+    """Node arrays of the trees of a fitted sklearn forest (or single tree).
+    Leaf values are the probability of class 1.
+    """
+    trees = []
+    for tree in getattr(estimator, 'estimators_', [estimator]):
+        tree = tree.tree_
+        value = tree.value[:, 0, :]
+        leaf = tree.children_left < 0
+        missing_left = getattr(tree, 'missing_go_to_left', np.ones(tree.node_count, dtype=bool)).astype(bool)
+        trees.append({
+            'feature': np.where(leaf, 0, tree.feature),
+            'threshold': float32_threshold(tree.threshold),
+            'left': tree.children_left,
+            'right': tree.children_right,
+            'missing': np.where(missing_left, tree.children_left, tree.children_right),
+            'value': value[:, -1] / value.sum(axis=1)
+        })
+    return trees
+
+
+def xgboost_trees(estimator):
+    """Node arrays of the trees a fitted XGBClassifier predicts with (up to its
+    best iteration when it was early-stopped). Leaf values are margins.
+    """
+    booster = estimator.get_booster()
+    config = json.loads(booster.save_config())
+    n_trees = None
+    if getattr(estimator, 'best_iteration', None) is not None:
+        parallel_trees = int(config['learner']['gradient_booster'].get('gbtree_model_param', {})
+                             .get('num_parallel_tree', 1))
+        n_trees = (estimator.best_iteration + 1) * parallel_trees
+
+    feature_names = booster.feature_names or []
+    trees = []
+    for dump in booster.get_dump(dump_format='json')[:n_trees]:
+        nodes = {}
+        stack = [json.loads(dump)]
+        while stack:
+            node = stack.pop()
+            nodes[node['nodeid']] = node
+            stack.extend(node.get('children', []))
+
+        count = max(nodes) + 1
+        tree = {'feature': np.zeros(count, dtype=np.int32), 'threshold': np.full(count, np.inf, dtype=np.float32),
+                'left': np.full(count, -1), 'right': np.full(count, -1), 'missing': np.full(count, -1),
+                'value': np.zeros(count)}
+        for node_id, node in nodes.items():
+            if 'leaf' in node:
+                tree['value'][node_id] = node['leaf']
+                continue
+            split = node['split']
+            tree['feature'][node_id] = feature_names.index(split) if split in feature_names else int(split[1:])
+            tree['threshold'][node_id] = float32_threshold(node['split_condition'], strict=True)
+            tree['left'][node_id], tree['right'][node_id] = node['yes'], node['no']
+            tree['missing'][node_id] = node['missing']
+        trees.append(tree)
+
+    base_score = float(config['learner']['learner_model_param']['base_score'].strip('[]'))
+    return trees, np.log(base_score / (1.0 - base_score))
+
+
+def is_tree_ensemble(estimator):
+    return hasattr(estimator, 'get_booster') or hasattr(estimator, 'tree_') or (
+        hasattr(estimator, 'estimators_') and all(hasattr(tree, 'tree_') for tree in estimator.estimators_))
+
+
+class CompiledEnsemble:
+    """The members of a voting ensemble with every tree model flattened into
+    one set of contiguous node arrays (feature, float32 threshold, left/right/
+    missing child, leaf value). All trees of all members are walked together,
+    one level per step over the whole batch, and each member's leaves are then
+    averaged (forests) or summed into a margin (XGBoost). Members that are
+    not tree ensembles are kept and called as usual.
+
+    Missing (NaN) features follow each split's default branch; for sparse input
+    XGBoost members also treat zeros as missing, as XGBoost does for entries
+    absent from a CSR matrix.
+    """
+
+    def __init__(self, estimators, voting='hard', weights=None, batch_size=256):
+        if voting not in ROW_WISE_VOTING:
+            raise ValueError('{0} voting depends on the batch and cannot be compiled'.format(voting))
+        self.voting = voting
+        self.weights = weights
+        self.batch_size = batch_size
+
+        self.members = []
+        trees = []
+        for estimator in estimators:
+            if not is_tree_ensemble(estimator):
+                self.members.append(('estimator', estimator))
+                continue
+
+            if hasattr(estimator, 'get_booster'):
+                member_trees, bias = xgboost_trees(estimator)
+                self.members.append(('boosting', slice(len(trees), len(trees) + len(member_trees)), bias))
+            else:
+                member_trees = sklearn_trees(estimator)
+                self.members.append(('forest', slice(len(trees), len(trees) + len(member_trees)), None))
+            for tree in member_trees:
+                tree['zero_missing'] = hasattr(estimator, 'get_booster')
+            trees.extend(member_trees)
+
+        offsets = np.cumsum([0] + [len(tree['feature']) for tree in trees])
+        self.roots = offsets[:-1].astype(np.int32)
+        self.feature = np.concatenate([tree['feature'] for tree in trees] or [[]]).astype(np.int32)
+        self.threshold = np.concatenate([tree['threshold'] for tree in trees] or [[]]).astype(np.float32)
+        self.children = np.concatenate(
+            [np.column_stack([tree['left'], tree['right'], tree['missing']]) + offset
+             for tree, offset in zip(trees, offsets)] or [np.zeros((0, 3))]).astype(np.int32)
+        self.leaf = np.concatenate([tree['left'] < 0 for tree in trees] or [[]]).astype(bool)
+        self.value = np.concatenate([tree['value'] for tree in trees] or [[]]).astype(np.float64)
+        self.zero_missing = np.array([tree['zero_missing'] for tree in trees], dtype=bool)
+
+    def leaf_values(self, x):
+        """Leaf value reached in every tree, as a (rows, trees) array. Only
+        the (row, tree) pairs that have not reached a leaf yet take the next
+        step.
+        """
+        zero_missing = sparse.issparse(x) and self.zero_missing.any()
+        x = np.ascontiguousarray(x.toarray() if sparse.issparse(x) else x, dtype=np.float32)
+        check_missing = zero_missing or np.isnan(x).any()
+        n_rows, n_trees = x.shape[0], len(self.roots)
+
+        nodes = np.tile(self.roots, n_rows)
+        row_offsets = np.repeat(np.arange(n_rows) * x.shape[1], n_trees)
+        active = np.flatnonzero(~self.leaf[nodes])
+        x = x.ravel()
+        while active.size:
+            current = nodes[active]
+            values = x[row_offsets[active] + self.feature[current]]
+            branch = (values > self.threshold[current]).astype(np.intp)
+            if check_missing:
+                is_missing = np.isnan(values)
+                if zero_missing:
+                    is_missing |= (values == 0) & self.zero_missing[active % n_trees]
+                branch[is_missing] = 2
+
+            current = self.children[current, branch]
+            nodes[active] = current
+            active = active[~self.leaf[current]]
+
+        return self.value[nodes].reshape(n_rows, n_trees)
+
+    def member_predictions(self, x):
+        """Class predictions and class 1 probabilities, one row per member.
+        """
+        predictions, proba = [], []
+        for start in range(0, x.shape[0], self.batch_size):
+            batch = x[start:start + self.batch_size]
+            leaves = self.leaf_values(batch) if len(self.roots) else None
+
+            batch_proba = []
+            for member in self.members:
+                if member[0] == 'estimator':
+                    batch_proba.append(member[1].predict_proba(batch)[:, 1] if hasattr(member[1], 'predict_proba')
+                                       else member[1].predict(batch).astype(np.float64))
+                elif member[0] == 'forest':
+                    batch_proba.append(leaves[:, member[1]].mean(axis=1))
+                else:
+                    batch_proba.append(1.0 / (1.0 + np.exp(-(leaves[:, member[1]].sum(axis=1) + member[2]))))
+            proba.append(np.vstack(batch_proba))
+            predictions.append(np.vstack([
+                member[1].predict(batch) if member[0] == 'estimator' else (member_proba > 0.5).astype(int)
+                for member, member_proba in zip(self.members, batch_proba)]))
+
+        return np.hstack(predictions), np.hstack(proba)
+
+    def predict(self, x):
+        predictions, proba = self.member_predictions(x)
+        return combine(predictions, proba, weights=self.weights, voting=self.voting)
+
+    def check_parity(self, estimators, x):
+        """Raise ValueError unless every member predicts [x] exactly like the
+        estimator it was compiled from, with matching probabilities.
+        """
+        predictions, proba = self.member_predictions(x)
+        for index, estimator in enumerate(estimators):
+            name = type(estimator).__name__
+            if not np.array_equal(predictions[index], estimator.predict(x)):
+                raise ValueError('Compiled {0} predictions differ from the original'.format(name))
+            if hasattr(estimator, 'predict_proba') and not np.allclose(
+                    proba[index], estimator.predict_proba(x)[:, 1], rtol=1e-5, atol=1e-6):
+                raise ValueError('Compiled {0} probabilities differ from the original'.format(name))
+
+        return None
@@ -0,0 +1,71 @@
+from fold_cache import model_key
+
+import json
+import os
+import sqlite3
+import time
+
+import numpy as np
+
+
+def to_json(params):
+    """JSON text of a parameter set, with numpy scalars as plain numbers.
+    """
+    return json.dumps(params, sort_keys=True,
+                      default=lambda value: value.item() if isinstance(value, np.generic) else str(value))
+
+
+class TrialStore:
+    """SQLite database of hyper parameter trials. A trial is one fold of one
+    parameter set, keyed by the data set fingerprint, the estimator (class and
+    full parameters, see fold_cache.model_key), the fold scheme and the fold
+    index. Scores and fit times are written as soon as a trial finishes, so an
+    interrupted search resumes where it stopped, and a widened grid only
+    evaluates its new points. Failed trials are kept but not returned by
+    scores, so the next search retries them.
+    """
+
+    def __init__(self, file_name='temp/trials.sqlite'):
+        self.file_name = file_name
+        directory = os.path.dirname(file_name)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.connection = sqlite3.connect(file_name)
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS trials ('
+            'dataset TEXT, model TEXT, estimator TEXT, fold_scheme TEXT, fold INTEGER, '
+            'params TEXT, score REAL, fit_seconds REAL, created REAL, '
+            'PRIMARY KEY (dataset, estimator, fold_scheme, fold))')
+        self.connection.commit()
+
+    def scores(self, dataset, fold_scheme):
+        """Stored scores of the completed trials of a data set and fold scheme
+        by (estimator, fold), where estimator is the repr of
+        fold_cache.model_key.
+        """
+        rows = self.connection.execute(
+            'SELECT estimator, fold, score FROM trials '
+            'WHERE dataset = ? AND fold_scheme = ? AND score IS NOT NULL',
+            (dataset, fold_scheme))
+        return dict(((estimator, fold), score) for estimator, fold, score in rows)
+
+    def record(self, trials):
+        """Write (dataset, estimator, fold_scheme, fold, params, score,
+        fit_seconds) tuples in one transaction. A None score (a failed fit) is
+        stored as NULL and replaced when the trial is retried.
+        """
+        now = time.time()
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO trials VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(dataset, type(estimator).__name__, repr(model_key(estimator)), fold_scheme, fold, to_json(params),
+              score, fit_seconds, now)
+             for dataset, estimator, fold_scheme, fold, params, score, fit_seconds in trials])
+        self.connection.commit()
+
+        return None
+
+    def close(self):
+        self.connection.close()
+
+        return None